@@ -1,47 +1,206 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template, request, redirect, url_for, jsonify, abort, session
 from datetime import datetime
-import json
+from functools import wraps
+import hashlib
+import hmac
+import logging
 import os
+import urllib.request
+
+from storage import get_storage, SqliteStorage
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)  # Define app FIRST
-USER_DATA_FILE = "users.json"
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "1029@tanishk")  # Use env var with fallback
+# Signs the login session cookie; set it when running several workers so they all accept it
+app.secret_key = os.environ.get("ADMIN_SECRET_KEY") or os.urandom(32)
+# Browsers don't send the cookie with cross-site requests, so other sites can't post to /delete
+app.config.update(SESSION_COOKIE_HTTPONLY=True, SESSION_COOKIE_SAMESITE='Strict')
+BOT_METRICS_URL = os.environ.get("BOT_METRICS_URL", "http://127.0.0.1:9100/metrics")  # Bot's METRICS_PORT
+ADMIN_HOST = os.environ.get("ADMIN_HOST", "127.0.0.1")
+ADMIN_PORT = int(os.environ.get("ADMIN_PORT", 5000))
+ADMIN_THREADS = int(os.environ.get("ADMIN_THREADS", 8))
+API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.environ.get("API_MAX_PAGE_SIZE", 200))
+
+# Same storage the bot writes to (STORAGE_BACKEND, USER_INDEX_FILE, SQLITE_PATH, ...)
+storage = get_storage()
+
+@app.before_request
+def refresh_storage():
+    # The bot writes from another process; reload the indexes if they changed
+    storage.refresh()
+
+def check_password(password):
+    return password is not None and hmac.compare_digest(password.encode(), ADMIN_PASSWORD.encode())
+
+def require_password(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not check_password(request.headers.get('X-Admin-Password')):
+            return jsonify(error="Invalid password"), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+# Browser pages: a session from /login, or the API header
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not session.get('admin') and not check_password(request.headers.get('X-Admin-Password')):
+            return redirect(url_for('login'))
+        return view(*args, **kwargs)
+    return wrapper
+
+def page_args():
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(API_MAX_PAGE_SIZE, max(1, int(request.args.get('per_page', API_PAGE_SIZE))))
+    except ValueError:
+        abort(400)
+    return page, per_page, request.args.get('q', '').strip() or None
+
+# ETag derived from the storage version and the request, so unchanged pages cost no storage reads
+def conditional_json(version, build):
+    etag = hashlib.sha1(f"{version}:{request.full_path}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def users_page(page, per_page, query):
+    total = storage.count_users(query)
+    return {
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'users': storage.list_profiles((page - 1) * per_page, per_page, query)
+    }
 
-def load_users():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+# Page 1 is the newest messages; messages inside a page are oldest first
+def history_page(user_number, page, per_page, query):
+    if query:
+        query = query.lower()
+        history = [msg for msg in storage.get_history(user_number) if query in msg['content'].lower()]
+        end = len(history) - (page - 1) * per_page
+        return {
+            'user_number': user_number,
+            'total': len(history),
+            'page': page,
+            'per_page': per_page,
+            'messages': history[max(0, end - per_page):max(0, end)]
+        }
+    # One extra message tells us whether an older page exists without counting the history
+    messages = storage.get_history(user_number, per_page + 1, (page - 1) * per_page)
+    return {
+        'user_number': user_number,
+        'page': page,
+        'per_page': per_page,
+        'has_older': len(messages) > per_page,
+        'messages': messages[-per_page:]
+    }
+
+def remove_user(user_number):
+    # The JSON backend keeps its indexes in the bot's memory and would write a deleted user back.
+    # With SQLite the bot notices on its next flush for that user and drops their session.
+    if not isinstance(storage, SqliteStorage):
+        return None
+    return storage.delete_user(user_number)
 
 @app.route('/ping')  # Now works because app is defined
 def ping():
     print(f"Ping received at {datetime.now()}")
     return "I'm alive!", 200
 
+@app.route('/metrics')  # Proxies the bot process's Prometheus metrics
+def metrics():
+    try:
+        with urllib.request.urlopen(BOT_METRICS_URL, timeout=5) as response:
+            return response.read(), 200, {'Content-Type': response.headers.get('Content-Type', 'text/plain')}
+    except OSError as e:
+        return f"Bot metrics unavailable: {e}", 503
+
+@app.route('/api/users')
+@require_password
+def api_users():
+    page, per_page, query = page_args()
+    return conditional_json(storage.data_version(), lambda: users_page(page, per_page, query))
+
+@app.route('/api/users/<user_number>')
+@require_password
+def api_user(user_number):
+    user_data = storage.get_user(user_number)
+    if user_data is None:
+        return jsonify(error="User not found"), 404
+    return conditional_json(storage.data_version(), lambda: dict(user_data, user_number=user_number))
+
+@app.route('/api/users/<user_number>/history')
+@require_password
+def api_history(user_number):
+    if storage.get_user(user_number) is None:
+        return jsonify(error="User not found"), 404
+    page, per_page, query = page_args()
+    return conditional_json(
+        storage.data_version(user_number),
+        lambda: history_page(user_number, page, per_page, query)
+    )
+
+@app.route('/api/users/<user_number>', methods=['DELETE'])
+@require_password
+def api_delete_user(user_number):
+    deleted = remove_user(user_number)
+    if deleted is None:
+        return jsonify(error="Delete users from the Telegram admin panel with the JSON backend"), 409
+    if not deleted:
+        return jsonify(error="User not found"), 404
+    return jsonify(deleted=user_number)
+
 @app.route('/')
 def login():
     return render_template('login.html')
 
 @app.route('/login', methods=['POST'])
 def do_login():
-    password = request.form['password']
-    if password == ADMIN_PASSWORD:
+    if check_password(request.form.get('password')):
+        session.clear()
+        session['admin'] = True
         return redirect(url_for('dashboard'))
     return "Invalid password!", 403
 
+@app.route('/logout', methods=['POST'])
+def logout():
+    session.clear()
+    return redirect(url_for('login'))
+
 @app.route('/dashboard')
+@login_required
 def dashboard():
-    users = load_users()
-    return render_template('dashboard.html', users=users)
-
-@app.route('/delete/<user_id>')
-def delete_user(user_id):
-    users = load_users()
-    if user_id in users:
-        del users[user_id]
-        with open(USER_DATA_FILE, 'w') as f:
-            json.dump(users, f, indent=4)
+    page, per_page, query = page_args()
+    return render_template('dashboard.html', **users_page(page, per_page, query), q=query or '')
+
+# POST only, so links, prefetchers and crawlers can never delete anyone
+@app.route('/delete/<user_number>', methods=['POST'])
+@login_required
+def delete_user(user_number):
+    if remove_user(user_number) is None:
+        return "Delete users from the Telegram admin panel with the JSON backend", 409
     return redirect(url_for('dashboard'))
 
+# Multi-threaded server: waitress if installed, otherwise Flask's threaded server.
+# On Linux, several workers also work: gunicorn -w 4 admin:app
+def serve():
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        logger.info("waitress not installed, using Flask's threaded server")
+        app.run(host=ADMIN_HOST, port=ADMIN_PORT, threaded=True, debug=False)  # Disable debug mode for production
+        return
+    logger.info(f"Admin running on http://{ADMIN_HOST}:{ADMIN_PORT} with {ADMIN_THREADS} threads")
+    waitress_serve(app, host=ADMIN_HOST, port=ADMIN_PORT, threads=ADMIN_THREADS)
+
 if __name__ == '__main__':
-    app.run(debug=False)  # Disable debug mode for production
\ No newline at end of file
+    serve()
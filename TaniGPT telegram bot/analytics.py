@@ -0,0 +1,284 @@
+import os
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from context_window import CHARS_PER_TOKEN
+from storage import SqliteStorage
+
+logger = logging.getLogger(__name__)
+
+# Export settings: rows buffered per written batch, and users fetched per storage page
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", 20000))
+EXPORT_PAGE_USERS = int(os.environ.get("EXPORT_PAGE_USERS", 500))
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+USERS_SCHEMA = pa.schema([
+    ("user_number", pa.int64()),
+    ("telegram_id", pa.string()),
+    ("name", pa.string()),
+    ("phone_number", pa.string()),
+    ("messages", pa.int32()),
+    ("user_messages", pa.int32()),
+    ("prompt_chars", pa.int64()),
+    ("reply_chars", pa.int64()),
+    ("last_active", pa.timestamp("ms", tz="UTC")),
+])
+
+MESSAGES_SCHEMA = pa.schema([
+    ("user_number", pa.int64()),
+    ("seq", pa.int32()),
+    ("role", pa.string()),
+    ("content", pa.string()),
+    ("chars", pa.int32()),
+    ("created_at", pa.timestamp("ms", tz="UTC")),
+])
+
+
+def to_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc) if seconds is not None else None
+
+
+class TableWriter:
+    """Buffers rows column by column and writes them out as record batches of `batch_rows`.
+
+    The file is written under a temporary name and only renamed into place once it is
+    complete, so an interrupted export never leaves a truncated file behind.
+    """
+
+    def __init__(self, path, schema, file_format="parquet", batch_rows=EXPORT_BATCH_ROWS):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(self.tmp_path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def add(self, **row):
+        for name, values in self.columns.items():
+            values.append(row[name])
+        if len(self.columns["user_number"]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        count = len(self.columns["user_number"])
+        if not count:
+            return
+        self.writer.write_batch(pa.RecordBatch.from_pydict(self.columns, schema=self.schema))
+        self.rows += count
+        for values in self.columns.values():
+            values.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if hasattr(self, "sink"):
+            self.sink.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def export_paths(directory, file_format):
+    extension = FORMATS[file_format]
+    return os.path.join(directory, f"users{extension}"), os.path.join(directory, f"messages{extension}")
+
+
+# The format of an export directory, from the files in it
+def detect_format(directory):
+    for file_format in FORMATS:
+        if all(os.path.exists(path) for path in export_paths(directory, file_format)):
+            return file_format
+    raise FileNotFoundError(f"No users/messages export found in {directory}")
+
+
+def iter_batches(path, columns=None, batch_rows=EXPORT_BATCH_ROWS):
+    if path.endswith(FORMATS["parquet"]):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns)
+        return
+    # Batches point into the mapping, so it is left for the garbage collector to close
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    for index in range(reader.num_record_batches):
+        batch = reader.get_batch(index)
+        yield batch.select(columns) if columns else batch
+
+
+def iter_rows(path, batch_rows=EXPORT_BATCH_ROWS):
+    for batch in iter_batches(path, batch_rows=batch_rows):
+        yield from batch.to_pylist()
+
+
+# Walk the store one page of profiles and one user's history at a time into users + messages
+# files, so memory stays flat however many users there are. Reads go through the storage API
+# only, so it can run next to the bot.
+def export_store(storage, directory, file_format="parquet", batch_rows=EXPORT_BATCH_ROWS,
+                 page_users=EXPORT_PAGE_USERS):
+    os.makedirs(directory, exist_ok=True)
+    users_path, messages_path = export_paths(directory, file_format)
+    users = TableWriter(users_path, USERS_SCHEMA, file_format, batch_rows)
+    messages = TableWriter(messages_path, MESSAGES_SCHEMA, file_format, batch_rows)
+    offset = 0
+    while True:
+        page = storage.list_profiles(offset, page_users)
+        if not page:
+            break
+        offset += len(page)
+        for profile in page:
+            user_number = int(profile['user_number'])
+            history = storage.export_history(profile['user_number'])
+            user_messages = prompt_chars = reply_chars = 0
+            last_active = None
+            for seq, message in enumerate(history):
+                chars = len(message['content'])
+                if message['role'] == 'user':
+                    user_messages += 1
+                    prompt_chars += chars
+                elif message['role'] == 'assistant':
+                    reply_chars += chars
+                if message['created_at'] is not None:
+                    last_active = max(last_active or 0, message['created_at'])
+                messages.add(
+                    user_number=user_number,
+                    seq=seq,
+                    role=message['role'],
+                    content=message['content'],
+                    chars=chars,
+                    created_at=to_timestamp(message['created_at'])
+                )
+            if last_active is None:
+                last_active = storage.last_active(profile['user_number'])
+            users.add(
+                user_number=user_number,
+                telegram_id=profile['telegram_id'],
+                name=profile['name'],
+                phone_number=profile['phone_number'],
+                messages=len(history),
+                user_messages=user_messages,
+                prompt_chars=prompt_chars,
+                reply_chars=reply_chars,
+                last_active=to_timestamp(last_active)
+            )
+        logger.info(f"Exported {offset} users")
+    users.close()
+    messages.close()
+    return users.rows, messages.rows
+
+
+def add_counts(totals, counts):
+    for key, count in counts.items():
+        totals[key] = totals.get(key, 0) + int(count)
+
+
+# Nearest-rank percentile of a histogram, where counts[n] is how often the value n occurs
+def histogram_percentile(counts, percent):
+    total = int(counts.sum())
+    if not total:
+        return 0.0
+    rank = max(1, int(np.ceil(total * percent / 100)))
+    return float(np.searchsorted(np.cumsum(counts), rank))
+
+
+# Users active per day, from user message times. The export writes each user's messages
+# together, so only the user straddling two batches has to be remembered between them.
+def active_user_days(messages_path, batch_rows=EXPORT_BATCH_ROWS):
+    daily = {}
+    carry_user, carry_days = None, set()
+    for batch in iter_batches(messages_path, ["user_number", "role", "created_at"], batch_rows):
+        frame = batch.to_pandas()
+        frame = frame[(frame["role"] == "user") & frame["created_at"].notna()]
+        if frame.empty:
+            continue
+        pairs = pd.DataFrame({
+            "day": frame["created_at"].dt.floor("D"),
+            "user_number": frame["user_number"]
+        }).drop_duplicates()
+        if carry_user is not None:
+            pairs = pairs[~((pairs["user_number"] == carry_user) & pairs["day"].isin(list(carry_days)))]
+        add_counts(daily, pairs["day"].value_counts())
+        last_user = frame["user_number"].iloc[-1]
+        last_days = set(pairs.loc[pairs["user_number"] == last_user, "day"])
+        carry_days = carry_days | last_days if last_user == carry_user else last_days
+        carry_user = last_user
+    return daily or None
+
+
+# Aggregates over an export, batch by batch: memory depends on the batch size and the number
+# of days, not on the number of users. Only numeric columns are read, never the message text.
+def build_report(directory, batch_rows=EXPORT_BATCH_ROWS):
+    users_path, messages_path = export_paths(directory, detect_format(directory))
+    columns = ["messages", "user_messages", "prompt_chars", "reply_chars", "last_active"]
+    users = total_messages = total_prompts = prompt_chars = reply_chars = 0
+    # turns[n] = users with n messages of their own
+    turns = np.zeros(1, dtype=np.int64)
+    last_active = {}
+    for batch in iter_batches(users_path, columns, batch_rows):
+        frame = batch.to_pandas()
+        users += len(frame)
+        total_messages += int(frame["messages"].sum())
+        total_prompts += int(frame["user_messages"].sum())
+        prompt_chars += int(frame["prompt_chars"].sum())
+        reply_chars += int(frame["reply_chars"].sum())
+        counts = np.bincount(frame["user_messages"].to_numpy(), minlength=len(turns))
+        turns = np.pad(turns, (0, len(counts) - len(turns))) + counts
+        add_counts(last_active, frame["last_active"].dropna().dt.floor("D").value_counts())
+    turns[0] = 0
+    users_with_history = int(turns.sum())
+    total_replies = total_messages - total_prompts
+    mean_prompt_chars = prompt_chars / total_prompts if total_prompts else 0.0
+    report = {
+        "users": users,
+        "users_with_history": users_with_history,
+        "messages": total_messages,
+        "user_messages": total_prompts,
+        "turns_mean": total_prompts / users_with_history if users_with_history else 0.0,
+        "turns_p50": histogram_percentile(turns, 50),
+        "turns_p95": histogram_percentile(turns, 95),
+        "turns_max": int(np.flatnonzero(turns)[-1]) if users_with_history else 0,
+        "prompt_chars_mean": float(mean_prompt_chars),
+        "prompt_tokens_mean": float(mean_prompt_chars / CHARS_PER_TOKEN),
+        "reply_chars_mean": reply_chars / total_replies if total_replies > 0 else 0.0,
+    }
+    daily = active_user_days(messages_path, batch_rows)
+    if daily is not None:
+        report["daily_active_source"] = "messages"
+    else:
+        # The JSON backends keep no per-message times; fall back to each user's last write
+        report["daily_active_source"] = "last_active"
+        daily = last_active
+    report["daily_active_users"] = {day.strftime("%Y-%m-%d"): daily[day] for day in sorted(daily)}
+    return report
+
+
+# Merge the users and messages streams back into import_user tuples; both are in export order
+def iter_import_users(directory, keep_times=False, batch_rows=EXPORT_BATCH_ROWS):
+    users_path, messages_path = export_paths(directory, detect_format(directory))
+    messages = iter_rows(messages_path, batch_rows)
+    pending = next(messages, None)
+    for user in iter_rows(users_path, batch_rows):
+        history = []
+        while pending is not None and pending['user_number'] == user['user_number']:
+            message = {'role': pending['role'], 'content': pending['content']}
+            if keep_times and pending['created_at'] is not None:
+                message['created_at'] = pending['created_at'].timestamp()
+            history.append(message)
+            pending = next(messages, None)
+        if len(history) != user['messages']:
+            raise ValueError(f"Export is inconsistent: user {user['user_number']} has "
+                             f"{len(history)} of {user['messages']} messages")
+        yield user['telegram_id'], str(user['user_number']), user['name'], user['phone_number'], history
+    if pending is not None:
+        raise ValueError(f"Export is inconsistent: messages for unknown user {pending['user_number']}")
+
+
+def import_store(storage, directory, batch_rows=EXPORT_BATCH_ROWS):
+    # Only SQLite stores message times; the JSON backends would hand them to the LLM with the history
+    keep_times = isinstance(storage, SqliteStorage)
+    return storage.import_users(iter_import_users(directory, keep_times, batch_rows))
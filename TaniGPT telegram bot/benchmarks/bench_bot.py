@@ -0,0 +1,372 @@
+"""Offline load test for the TaniGPT handlers.
+
+Drives the real handlers in main.py (start/get_name/get_phone/handle_text/clear) with
+synthetic Telegram updates, a local fake Bot and a mock Mistral client, then reports
+handler latency percentiles, throughput and storage I/O per turn.
+
+    python benchmarks/bench_bot.py --users 1,10,100 --history 0,200 --messages 10
+    python benchmarks/bench_bot.py --backend sqlite --latency lognormal --latency-ms 1500
+
+Every configuration runs in a fresh subprocess and a temporary working directory,
+so no real user data is touched and no network calls are made.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import types
+from datetime import datetime
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Messages that do not hit a local intent, so every turn reaches the (mock) LLM
+PROMPTS = [
+    "hello bhai kya haal hai",
+    "mujhe ek joke sunao",
+    "python mein list comprehension kaise likhte hain",
+    "weekend pe kya karna chahiye",
+    "ek acchi movie suggest karo",
+    "how do I stay focused while studying",
+    "explain black holes in simple words",
+    "what should I cook for dinner",
+]
+
+STORAGE_METHODS = [
+    "get_user_number", "get_user", "list_users", "phone_exists", "create_user", "delete_user",
+    "get_history", "append_messages", "reset_history",
+]
+
+
+class LatencyModel:
+    """Mock LLM latency: constant, uniform(0.5x..1.5x) or lognormal around a median."""
+
+    def __init__(self, kind, median_ms, sigma):
+        self.kind = kind
+        self.median = median_ms / 1000
+        self.sigma = sigma
+
+    def sample(self):
+        if self.kind == "constant":
+            return self.median
+        if self.kind == "uniform":
+            return random.uniform(0.5 * self.median, 1.5 * self.median)
+        return random.lognormvariate(0, self.sigma) * self.median
+
+
+class MockChat:
+    def __init__(self, latency, reply_words, chunks):
+        self.latency = latency
+        self.reply_words = reply_words
+        self.chunks = chunks
+        self.calls = 0
+
+    def reply(self):
+        return " ".join(random.choice(PROMPTS).split()[0] for _ in range(self.reply_words))
+
+    async def complete_async(self, model, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        message = types.SimpleNamespace(content=self.reply())
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    async def stream_async(self, model, messages, **kwargs):
+        self.calls += 1
+        return MockStream(self.reply(), self.latency.sample(), self.chunks)
+
+
+class MockStream:
+    def __init__(self, text, total_latency, chunks):
+        words = text.split(" ")
+        size = max(1, len(words) // chunks)
+        self.parts = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        self.delay = total_latency / len(self.parts)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.parts:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.delay)
+        delta = types.SimpleNamespace(content=self.parts.pop(0))
+        return types.SimpleNamespace(data=types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)]))
+
+
+class MockMistral:
+    def __init__(self, latency, reply_words=40, chunks=8):
+        self.chat = MockChat(latency, reply_words, chunks)
+
+
+class StorageProbe:
+    """Counts calls and time spent in each storage method (called from threads too)."""
+
+    def __init__(self, storage):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.seconds = {}
+        for name in STORAGE_METHODS:
+            if hasattr(storage, name):
+                setattr(storage, name, self.wrap(name, getattr(storage, name)))
+
+    def wrap(self, name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.calls[name] = self.calls.get(name, 0) + 1
+                    self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        return timed
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls), dict(self.seconds)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_config(args):
+    from telegram import Bot, Chat, Message, Update, User
+
+    import main
+
+    # Telegram objects are frozen, so the fake bot keeps its counters out here
+    counters = {"sent": 0, "edits": 0}
+    message_ids = iter(range(1, 10 ** 9))
+
+    class FakeBot(Bot):
+        """Answers every Bot API call locally and records what would have been sent."""
+
+        def make_message(self, chat_id, text):
+            message = Message(next(message_ids), datetime.now(), Chat(chat_id, Chat.PRIVATE), text=text)
+            message.set_bot(self)
+            return message
+
+        async def send_message(self, chat_id, text, **kwargs):
+            counters["sent"] += 1
+            return self.make_message(chat_id, text)
+
+        async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+            counters["edits"] += 1
+            return self.make_message(chat_id, text)
+
+        async def send_chat_action(self, chat_id, action, **kwargs):
+            return True
+
+    bot = FakeBot(token="123456:benchmark")
+    update_ids = iter(range(1, 10 ** 9))
+
+    def make_update(user_id, text):
+        user = User(user_id, f"bench{user_id}", False)
+        message = Message(
+            next(message_ids), datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=user, text=text
+        )
+        message.set_bot(bot)
+        return Update(next(update_ids), message=message)
+
+    # Signup ends by dropping the emptied user_data through the application
+    application = types.SimpleNamespace(drop_user_data=lambda user_id: None)
+
+    def make_context():
+        return types.SimpleNamespace(bot=bot, application=application, user_data={})
+
+    latency = LatencyModel(args.latency, args.latency_ms, args.sigma)
+    mock = MockMistral(latency, args.reply_words)
+    main.llm_gateway.client = mock
+    probe = StorageProbe(main.storage)
+    await main.post_init(None)
+
+    # Signup every simulated user through the real conversation handlers
+    user_ids = [10 ** 9 + i for i in range(args.users)]
+    for index, user_id in enumerate(user_ids):
+        context = make_context()
+        await main.start(make_update(user_id, "/start"), context)
+        await main.get_name(make_update(user_id, f"Bench User {index}"), context)
+        await main.get_phone(make_update(user_id, f"{7000000000 + index}"), context)
+
+    # Pre-grow histories to the requested length without going through the LLM
+    if args.history:
+        filler = []
+        for i in range(args.history):
+            role = "user" if i % 2 == 0 else "assistant"
+            filler.append({"role": role, "content": random.choice(PROMPTS)})
+        for user_id in user_ids:
+            main.storage.append_messages(main.storage.get_user_number(user_id), filler)
+        # Sessions loaded during signup hold the short history, start from storage instead
+        for user_id in user_ids:
+            main.session_cache.invalidate(main.storage.get_user_number(user_id))
+
+    calls_before, seconds_before = probe.snapshot()
+    llm_calls_before = mock.chat.calls
+    latencies = []
+
+    async def converse(user_id):
+        for _ in range(args.messages):
+            await asyncio.sleep(random.uniform(0, args.think_ms / 1000))
+            start = time.perf_counter()
+            await main.handle_text(make_update(user_id, random.choice(PROMPTS)), make_context())
+            latencies.append(time.perf_counter() - start)
+        if args.clear:
+            await main.clear(make_update(user_id, "/clear"), make_context())
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(converse(user_id) for user_id in user_ids))
+    # The write-behind flush is part of the cost of the turns above
+    await main.session_cache.flush()
+    wall = time.perf_counter() - wall_start
+
+    calls_after, seconds_after = probe.snapshot()
+    await main.post_shutdown(None)
+
+    turns = len(latencies)
+    storage_calls = sum(calls_after.values()) - sum(calls_before.values())
+    storage_seconds = sum(seconds_after.values()) - sum(seconds_before.values())
+    return {
+        "backend": os.environ.get("STORAGE_BACKEND", "json"),
+        "users": args.users,
+        "history": args.history,
+        "turns": turns,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "msgs_per_sec": turns / wall if wall else 0.0,
+        "llm_calls": mock.chat.calls - llm_calls_before,
+        "storage_calls_per_turn": storage_calls / turns if turns else 0.0,
+        "storage_ms_per_turn": storage_seconds * 1000 / turns if turns else 0.0,
+        "storage_calls": {
+            name: calls_after.get(name, 0) - calls_before.get(name, 0)
+            for name in calls_after
+            if calls_after.get(name, 0) != calls_before.get(name, 0)
+        },
+        "telegram_sends": counters["sent"],
+        "telegram_edits": counters["edits"],
+    }
+
+
+def run_child(args):
+    workdir = tempfile.mkdtemp(prefix="tanigpt-bench-")
+    try:
+        intents_file = os.path.join(BOT_DIR, "intents.json")
+        if os.path.exists(intents_file):
+            shutil.copy(intents_file, workdir)
+        os.chdir(workdir)
+        sys.path.insert(0, BOT_DIR)
+        random.seed(args.seed)
+        result = asyncio.run(run_config(args))
+    finally:
+        os.chdir(BOT_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("RESULT " + json.dumps(result))
+
+
+def run_sweep(args):
+    env = dict(os.environ)
+    env.setdefault("MISTRAL_API_KEY", "benchmark")
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    env["STORAGE_BACKEND"] = args.backend
+    env["STREAM_RESPONSES"] = "true" if args.stream else "false"
+    env["METRICS_PORT"] = "0"
+    # The per-user limiter would drop most synthetic traffic; measure it only when asked
+    if not args.rate_limit:
+        env["RATE_LIMIT_USER_RATE"] = "0"
+        env["RATE_LIMIT_GLOBAL_RATE"] = "0"
+    if not args.verbose:
+        env["BENCH_QUIET"] = "1"
+
+    results = []
+    for users in args.users:
+        for history in args.history:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--child",
+                "--users", str(users), "--history", str(history),
+                "--messages", str(args.messages), "--think-ms", str(args.think_ms),
+                "--latency", args.latency, "--latency-ms", str(args.latency_ms),
+                "--sigma", str(args.sigma), "--reply-words", str(args.reply_words),
+                "--seed", str(args.seed),
+            ]
+            if args.clear:
+                command.append("--clear")
+            output = subprocess.run(command, env=env, capture_output=True, text=True)
+            lines = [line for line in output.stdout.splitlines() if line.startswith("RESULT ")]
+            if output.returncode != 0 or not lines:
+                print(output.stderr, file=sys.stderr)
+                raise SystemExit(f"Benchmark run failed for users={users} history={history}")
+            results.append(json.loads(lines[-1][len("RESULT "):]))
+            print_row(results[-1], header=len(results) == 1)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+def print_row(result, header=False):
+    if header:
+        print(f"{'backend':<8}{'users':>7}{'history':>9}{'turns':>7}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'msg/s':>9}{'llm':>6}{'io/turn':>9}{'io ms/turn':>12}")
+    print(f"{result['backend']:<8}{result['users']:>7}{result['history']:>9}{result['turns']:>7}"
+          f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+          f"{result['msgs_per_sec']:>9.1f}{result['llm_calls']:>6}"
+          f"{result['storage_calls_per_turn']:>9.2f}{result['storage_ms_per_turn']:>12.3f}")
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the TaniGPT bot handlers")
+    parser.add_argument("--users", type=int_list, default=[1, 10, 50], help="comma separated user counts")
+    parser.add_argument("--history", type=int_list, default=[0, 200], help="comma separated pre-filled history lengths")
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each user")
+    parser.add_argument("--think-ms", type=float, default=50, help="max random pause between a user's messages")
+    parser.add_argument("--latency", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=200, help="median mock LLM latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal spread")
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument("--backend", choices=["json", "archive", "sqlite"], default=os.environ.get("STORAGE_BACKEND", "json"))
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming reply path")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the per-user and global rate limits on")
+    parser.add_argument("--clear", action="store_true", help="send /clear after each user's messages")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write all results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own logging")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        args.users = args.users[0]
+        args.history = args.history[0]
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child:
+        if os.environ.get("BENCH_QUIET"):
+            import logging
+            logging.disable(logging.WARNING)
+        run_child(arguments)
+    else:
+        run_sweep(arguments)
@@ -0,0 +1,204 @@
+"""Cold-start benchmark for the TaniGPT bot.
+
+Every run is a fresh Python process in a temporary working directory holding a
+pre-built user store. It measures what a restarted container or a scale-to-zero
+webhook pays before the first user gets an answer:
+
+    process               a bare `python -c "import main"`: interpreter start plus import
+    import main           importing the bot module (Telegram, gateway, storage proxy...)
+    storage open          loading the storage backend on first use
+    first reply           the first signed-up user's message, end to end, with a mock LLM
+    llm client            importing the Mistral SDK and building the client (no network)
+
+    python benchmarks/bench_startup.py --runs 5 --users 1000,20000
+    python benchmarks/bench_startup.py --backend sqlite --importtime
+
+No real user data is touched and no network calls are made.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_store(users):
+    sys.path.insert(0, BOT_DIR)
+    from storage import get_storage
+    storage = get_storage()
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": "kya haal hai bhai, sab badhiya?"}
+        for i in range(20)
+    ]
+    # At least the user who sends the first message
+    storage.import_users(
+        (str(10 ** 9 + index), str(index + 1), f"Bench User {index}", f"{7000000000 + index}", history)
+        for index in range(max(1, users))
+    )
+    storage.close()
+
+
+async def measure():
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+
+    sys.path.insert(0, BENCH_DIR)
+    from bench_bot import LatencyModel, MockMistral
+    from telegram import Bot, Chat, Message, Update, User
+
+    class FakeBot(Bot):
+        """Answers the Bot API calls the text handler makes, locally."""
+
+        async def send_message(self, chat_id, text, **kwargs):
+            message = Message(1, datetime.now(), Chat(chat_id, Chat.PRIVATE), text=text)
+            message.set_bot(self)
+            return message
+
+        async def send_chat_action(self, chat_id, action, **kwargs):
+            return True
+
+    bot = FakeBot(token="123456:benchmark")
+    user = User(10 ** 9, "bench", False)
+    message = Message(1, datetime.now(), Chat(user.id, Chat.PRIVATE), from_user=user, text="hello bhai kya haal hai")
+    message.set_bot(bot)
+    context = type("Context", (), {"bot": bot, "user_data": {}})()
+
+    main.llm_gateway.client = MockMistral(LatencyModel("constant", 0, 0), 20)
+    start = time.perf_counter()
+    await main.post_init(None)
+    await main.handle_text(Update(1, message=message), context)
+    first_reply_seconds = time.perf_counter() - start
+
+    # Storage is open by now; time a second, fresh open of the same backend on its own
+    backend = type(main.storage.load())
+    start = time.perf_counter()
+    backend().close()
+    storage_seconds = time.perf_counter() - start
+
+    gateway = main.LLMGateway("benchmark", main.llm_scheduler, main.MODEL, main.LLM_TIMEOUT)
+    start = time.perf_counter()
+    gateway.client
+    client_seconds = time.perf_counter() - start
+    await gateway.close()
+
+    await main.post_shutdown(None)
+    return {
+        "import_ms": import_seconds * 1000,
+        "storage_ms": storage_seconds * 1000,
+        "first_reply_ms": first_reply_seconds * 1000,
+        "client_ms": client_seconds * 1000,
+    }
+
+
+def run_child():
+    sys.path.insert(0, BOT_DIR)
+    logging.disable(logging.WARNING)
+    result = asyncio.run(measure())
+    print("RESULT " + json.dumps(result))
+
+
+def import_profile(env, workdir, top):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {BOT_DIR!r}); import main"],
+        env=env, cwd=workdir, capture_output=True, text=True
+    )
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    print("\nSlowest imports under main (cumulative ms):")
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>10.1f}  {name}")
+
+
+def run_sweep(args):
+    env = dict(os.environ)
+    env.setdefault("MISTRAL_API_KEY", "benchmark")
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    env["STORAGE_BACKEND"] = args.backend
+    env["STARTUP_WARMUP"] = "true" if args.warmup else "false"
+    env["METRICS_PORT"] = "0"
+    env["PERSISTENCE_FILE"] = ""
+    env["RATE_LIMIT_USER_RATE"] = "0"
+    env["RATE_LIMIT_GLOBAL_RATE"] = "0"
+
+    print(f"{'backend':<8}{'users':>8}{'process ms':>12}{'import ms':>11}{'storage ms':>12}"
+          f"{'1st reply ms':>14}{'llm client ms':>15}")
+    for users in args.users:
+        workdir = tempfile.mkdtemp(prefix="tanigpt-startup-")
+        try:
+            intents_file = os.path.join(BOT_DIR, "intents.json")
+            if os.path.exists(intents_file):
+                shutil.copy(intents_file, workdir)
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--seed-store", str(users)],
+                env=env, cwd=workdir, check=True, capture_output=True
+            )
+            results = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, "-c", f"import sys; sys.path.insert(0, {BOT_DIR!r}); import main"],
+                    env=env, cwd=workdir, check=True, capture_output=True
+                )
+                process_ms = (time.perf_counter() - start) * 1000
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child"],
+                    env=env, cwd=workdir, capture_output=True, text=True
+                )
+                lines = [line for line in output.stdout.splitlines() if line.startswith("RESULT ")]
+                if output.returncode != 0 or not lines:
+                    print(output.stderr, file=sys.stderr)
+                    raise SystemExit(f"Startup run failed for users={users}")
+                results.append(dict(json.loads(lines[-1][len("RESULT "):]), process_ms=process_ms))
+            median = {key: statistics.median(result[key] for result in results) for key in results[0]}
+            print(f"{args.backend:<8}{users:>8}{median['process_ms']:>12.0f}{median['import_ms']:>11.0f}"
+                  f"{median['storage_ms']:>12.1f}{median['first_reply_ms']:>14.1f}{median['client_ms']:>15.0f}")
+            if args.importtime and users == args.users[-1]:
+                import_profile(env, workdir, args.top)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the TaniGPT bot")
+    parser.add_argument("--users", type=int_list, default=[100, 10000], help="comma separated store sizes")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per store size (median is shown)")
+    parser.add_argument("--backend", default="json", choices=["json", "archive", "sqlite"])
+    parser.add_argument("--warmup", action="store_true", help="keep STARTUP_WARMUP on (default: pure first-use)")
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed-store", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.seed_store is not None:
+        seed_store(args.seed_store)
+    elif args.child:
+        run_child()
+    else:
+        run_sweep(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Bot, Update
+
+from storage import STORAGE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Scale-out settings: one webhook ingress in front of CLUSTER_WORKERS bot processes
+CLUSTER_WORKERS = int(os.environ.get("CLUSTER_WORKERS", os.cpu_count() or 1))
+CLUSTER_WORKER_HOST = os.environ.get("CLUSTER_WORKER_HOST", "127.0.0.1")
+CLUSTER_WORKER_BASE_PORT = int(os.environ.get("CLUSTER_WORKER_BASE_PORT", 8600))
+CLUSTER_FORWARD_TIMEOUT = float(os.environ.get("CLUSTER_FORWARD_TIMEOUT", 10))
+CLUSTER_RESTART_DELAY = float(os.environ.get("CLUSTER_RESTART_DELAY", 2))
+CLUSTER_MAX_RESTART_DELAY = float(os.environ.get("CLUSTER_MAX_RESTART_DELAY", 60))
+CLUSTER_STOP_TIMEOUT = float(os.environ.get("CLUSTER_STOP_TIMEOUT", 15))
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN")
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+# The user an update belongs to; updates without one (channel posts, polls) return None
+def update_user_id(update):
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+    return None
+
+
+# Same user, same worker, so ConversationHandler state and sessions never move
+def shard_for(user_id, workers):
+    return user_id % workers if user_id is not None else 0
+
+
+def worker_url(index):
+    return f"http://{CLUSTER_WORKER_HOST}:{CLUSTER_WORKER_BASE_PORT + index}/update"
+
+
+class IngressHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != self.server.url_path:
+            self.respond(404)
+            return
+        if WEBHOOK_SECRET_TOKEN and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET_TOKEN:
+            self.respond(403)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.respond(400)
+            return
+        shard = shard_for(update_user_id(update), self.server.workers)
+        request = urllib.request.Request(worker_url(shard), data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=CLUSTER_FORWARD_TIMEOUT):
+                pass
+        except OSError as e:
+            # A non-2xx answer makes Telegram redeliver the update once the worker is back
+            logger.error(f"Worker {shard} did not accept update {update.get('update_id')}: {str(e)}")
+            self.respond(503)
+            return
+        self.respond(200)
+
+    def respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_ingress(url_path, workers, port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), IngressHandler)
+    server.url_path = url_path if url_path.startswith("/") else f"/{url_path}"
+    server.workers = workers
+    thread = threading.Thread(target=server.serve_forever, name="webhook-ingress", daemon=True)
+    thread.start()
+    logger.info(f"Webhook ingress listening on {host}:{port}, routing to {workers} workers")
+    return server
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/update":
+            self.respond(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = Update.de_json(json.loads(body), self.server.application.bot)
+        except ValueError:
+            self.respond(400)
+            return
+        self.server.loop.call_soon_threadsafe(self.server.application.update_queue.put_nowait, update)
+        self.respond(200)
+
+    def respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Local endpoint a worker's Application receives forwarded updates on
+def start_worker_server(application, loop, port, host=CLUSTER_WORKER_HOST):
+    server = ThreadingHTTPServer((host, port), WorkerHandler)
+    server.application = application
+    server.loop = loop
+    thread = threading.Thread(target=server.serve_forever, name="worker-updates", daemon=True)
+    thread.start()
+    return server
+
+
+# Run an Application that takes updates from the ingress instead of polling or a webhook
+async def serve_worker(application, port):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: the supervisor terminates the process instead
+            pass
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        server = start_worker_server(application, loop, port)
+        logger.info(f"Worker accepting updates on port {port}")
+        try:
+            await stop.wait()
+        finally:
+            server.shutdown()
+            server.server_close()
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+class Supervisor:
+    """Starts the worker processes, restarts crashed ones with backoff and stops them all on exit."""
+
+    def __init__(self, workers=CLUSTER_WORKERS, base_port=CLUSTER_WORKER_BASE_PORT):
+        self.workers = workers
+        self.base_port = base_port
+        self.processes = [None] * workers
+        self.restart_delays = [CLUSTER_RESTART_DELAY] * workers
+        self.restart_at = [0.0] * workers
+        self.started_at = [0.0] * workers
+        self.stopping = threading.Event()
+
+    def worker_env(self, index):
+        env = dict(os.environ)
+        env["WORKER_INDEX"] = str(index)
+        env["WORKER_PORT"] = str(self.base_port + index)
+        # Conversation state belongs to the users of one shard
+        state_file = env.get("PERSISTENCE_FILE", "bot_state.json")
+        if state_file:
+            root, ext = os.path.splitext(state_file)
+            env["PERSISTENCE_FILE"] = f"{root}_{index}{ext}"
+        # Each worker gets its own metrics port and a fair share of the global LLM rate
+        metrics_port = int(env.get("METRICS_PORT", 9100))
+        env["METRICS_PORT"] = str(metrics_port + index if metrics_port > 0 else 0)
+        global_rate = float(env.get("RATE_LIMIT_GLOBAL_RATE", 10))
+        global_burst = int(env.get("RATE_LIMIT_GLOBAL_BURST", 20))
+        env["RATE_LIMIT_GLOBAL_RATE"] = str(global_rate / self.workers)
+        env["RATE_LIMIT_GLOBAL_BURST"] = str(max(1, global_burst // self.workers))
+        return env
+
+    def start_worker(self, index):
+        self.processes[index] = subprocess.Popen([sys.executable, MAIN_SCRIPT], env=self.worker_env(index))
+        self.started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {self.processes[index].pid}) on port {self.base_port + index}")
+
+    def check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None and process.poll() is None:
+                # Reset the backoff once a worker has stayed up for a while
+                if now - self.started_at[index] > CLUSTER_MAX_RESTART_DELAY:
+                    self.restart_delays[index] = CLUSTER_RESTART_DELAY
+                continue
+            if process is not None:
+                delay = self.restart_delays[index]
+                logger.error(f"Worker {index} exited with code {process.returncode}, restarting in {delay:.0f}s")
+                self.processes[index] = None
+                self.restart_at[index] = now + delay
+                self.restart_delays[index] = min(CLUSTER_MAX_RESTART_DELAY, delay * 2)
+            elif now >= self.restart_at[index]:
+                self.start_worker(index)
+
+    def stop_workers(self):
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + CLUSTER_STOP_TIMEOUT
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            try:
+                process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Worker {index} did not stop in time, killing it")
+                process.kill()
+                process.wait()
+        logger.info("All workers stopped")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        for index in range(self.workers):
+            self.start_worker(index)
+        try:
+            while not self.stopping.wait(1):
+                self.check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_workers()
+
+
+def set_webhook(token, webhook_url):
+    async def register():
+        async with Bot(token) as bot:
+            await bot.set_webhook(
+                url=webhook_url,
+                allowed_updates=Update.ALL_TYPES,
+                secret_token=WEBHOOK_SECRET_TOKEN
+            )
+    asyncio.run(register())
+    logger.info(f"Webhook set to {webhook_url}")
+
+
+# Ingress plus supervised workers; all workers must share one SQLite database
+def run_cluster(token, domain, port, workers=CLUSTER_WORKERS):
+    if STORAGE_BACKEND != "sqlite" and workers > 1:
+        raise ValueError("Running several workers needs STORAGE_BACKEND=sqlite; JSON indexes are per process.")
+    supervisor = Supervisor(workers)
+    ingress = start_ingress(token, workers, port)
+    if domain:
+        set_webhook(token, f"https://{domain}/{token}")
+    else:
+        logger.warning("DOMAIN is not set, leaving the Telegram webhook as it is")
+    try:
+        supervisor.run()
+    finally:
+        ingress.shutdown()
+        ingress.server_close()
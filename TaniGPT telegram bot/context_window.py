@@ -0,0 +1,73 @@
+import os
+import math
+
+# Context window settings
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_MAX_MESSAGES = int(os.environ.get("CONTEXT_MAX_MESSAGES", 50))
+CONTEXT_SUMMARY = os.environ.get("CONTEXT_SUMMARY", "false").lower() == "true"
+CONTEXT_SUMMARY_MIN_MESSAGES = int(os.environ.get("CONTEXT_SUMMARY_MIN_MESSAGES", 6))
+CHARS_PER_TOKEN = float(os.environ.get("CHARS_PER_TOKEN", 3.5))
+
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below between a user and TaniGPT in at most 5 short sentences. "
+    "Keep names, facts and preferences the user shared. Reply with the summary only."
+)
+
+
+# Cheap local estimate; Mistral's tokenizer averages 3-4 characters per token for Hinglish/English
+def count_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message['content'])
+
+
+class ContextWindow:
+    """Packs the newest turns into a token budget, always keeping the system prompt first."""
+
+    def __init__(self, system_prompt, token_budget=CONTEXT_TOKEN_BUDGET, count=message_tokens):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.token_budget = token_budget
+        self.count = count
+
+    def summary_message(self, summary):
+        return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+    # Returns the messages to send and how many older turns did not fit
+    def build(self, history, summary=None):
+        pinned = [self.system_message]
+        if summary:
+            pinned.append(self.summary_message(summary))
+        budget = self.token_budget - sum(self.count(message) for message in pinned)
+
+        turns = [message for message in history if message['role'] != 'system']
+        packed = []
+        for message in reversed(turns):
+            cost = self.count(message)
+            # The newest message always goes in, even if it alone is over budget
+            if cost > budget and packed:
+                break
+            packed.append(message)
+            budget -= cost
+        packed.reverse()
+
+        # Start the window on a user turn
+        while len(packed) > 1 and packed[0]['role'] != 'user':
+            packed.pop(0)
+        return pinned + packed, len(turns) - len(packed)
+
+    def summary_request(self, messages, previous_summary=None):
+        transcript = "\n".join(
+            f"{'User' if message['role'] == 'user' else 'TaniGPT'}: {message['content']}"
+            for message in messages
+        )
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ]
@@ -0,0 +1,210 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, stop the bot by hand before compact-history
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# History archive settings
+# Messages kept in the uncompressed hot log; older ones are rolled into cold segments
+HISTORY_HOT_MESSAGES = int(os.environ.get("HISTORY_HOT_MESSAGES", 200))
+HISTORY_SEGMENT_MESSAGES = int(os.environ.get("HISTORY_SEGMENT_MESSAGES", 500))
+
+HOT_LOG = "hot.jsonl"
+LOCK_FILE = ".lock"
+SEGMENT_PATTERN = re.compile(r"^cold_(\d+)_(\d+)\.jsonl\.gz$")
+
+
+def encode_messages(messages):
+    return "".join(json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n" for message in messages)
+
+
+# Only newline-terminated lines count: a crash mid-append can leave a partial last line
+def decode_messages(text):
+    return [json.loads(line) for line in text.split("\n")[:-1] if line]
+
+
+class HistoryArchive:
+    """Per-user append-only history log: one hot JSON-lines file plus gzip'd cold segments.
+
+    New turns are appended to hot.jsonl, never rewriting what is already there. Once
+    the hot log holds HISTORY_SEGMENT_MESSAGES more than HISTORY_HOT_MESSAGES, its
+    oldest messages are written out as an immutable cold_<seq>_<count>.jsonl.gz
+    segment. The message count is in the segment's file name, so reads that only
+    need recent messages skip or stop before ever decompressing a segment.
+    """
+
+    def __init__(self, root, hot_messages=HISTORY_HOT_MESSAGES,
+                 segment_messages=HISTORY_SEGMENT_MESSAGES):
+        self.root = root
+        self.hot_messages = hot_messages
+        self.segment_messages = segment_messages
+        # user_number -> messages in the hot log, so appends don't have to count lines
+        self.hot_counts = {}
+        # Users whose hot log is known to end on a complete line
+        self.checked = set()
+        self.lock_file = None
+
+    def user_dir(self, user_number):
+        return os.path.join(self.root, f"user_{user_number}")
+
+    def hot_path(self, user_number):
+        return os.path.join(self.user_dir(user_number), HOT_LOG)
+
+    # (seq, count, path) of each cold segment, oldest first
+    def segments(self, user_number):
+        user_dir = self.user_dir(user_number)
+        if not os.path.isdir(user_dir):
+            return []
+        found = []
+        for name in os.listdir(user_dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), os.path.join(user_dir, name)))
+        return sorted(found)
+
+    def read_hot(self, user_number):
+        path = self.hot_path(user_number)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            messages = decode_messages(f.read())
+        self.hot_counts[user_number] = len(messages)
+        return messages
+
+    def read_segment(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return decode_messages(f.read())
+
+    def write_segment(self, user_number, seq, messages):
+        path = os.path.join(self.user_dir(user_number), f"cold_{seq:06d}_{len(messages)}.jsonl.gz")
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(encode_messages(messages))
+        os.replace(tmp_path, path)
+
+    def write_hot(self, user_number, messages):
+        path = self.hot_path(user_number)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(encode_messages(messages))
+        os.replace(tmp_path, path)
+        self.hot_counts[user_number] = len(messages)
+        self.checked.add(user_number)
+
+    # Cut a partial last line left by a crash, so the next append starts on a line of its own
+    def repair_hot(self, user_number):
+        path = self.hot_path(user_number)
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - 1))
+                if size and f.read(1) != b"\n":
+                    f.seek(0)
+                    end = f.read().rfind(b"\n") + 1
+                    f.truncate(end)
+                    logger.warning(f"Dropped {size - end} bytes of an incomplete message from {path}")
+        self.checked.add(user_number)
+
+    def exists(self, user_number):
+        return os.path.isdir(self.user_dir(user_number))
+
+    def append(self, user_number, messages):
+        os.makedirs(self.user_dir(user_number), exist_ok=True)
+        if user_number not in self.checked:
+            self.repair_hot(user_number)
+            self.read_hot(user_number)
+        elif user_number not in self.hot_counts:
+            self.read_hot(user_number)
+        with open(self.hot_path(user_number), 'a', encoding='utf-8') as f:
+            f.write(encode_messages(messages))
+        self.hot_counts[user_number] = self.hot_counts.get(user_number, 0) + len(messages)
+        if self.hot_counts[user_number] >= self.hot_messages + self.segment_messages:
+            self.roll(user_number)
+
+    # Move everything but the newest hot_messages out of the hot log into cold segments
+    def roll(self, user_number):
+        hot = self.read_hot(user_number)
+        overflow = len(hot) - self.hot_messages
+        if overflow < self.segment_messages:
+            return 0
+        segments = self.segments(user_number)
+        seq = segments[-1][0] + 1 if segments else 1
+        rolled = 0
+        while overflow - rolled >= self.segment_messages:
+            self.write_segment(user_number, seq, hot[rolled:rolled + self.segment_messages])
+            rolled += self.segment_messages
+            seq += 1
+        # Segments are in place before the hot log drops those messages
+        self.write_hot(user_number, hot[rolled:])
+        return rolled
+
+    # Up to `limit` messages ending `skip_recent` before the newest, oldest first. Cold
+    # segments newer than the page are skipped and older ones are never opened.
+    def read(self, user_number, limit=None, skip_recent=0):
+        hot = self.read_hot(user_number)
+        needed = limit + skip_recent if limit else None
+        chunks = []
+        newest_kept = None
+        seen = 0
+        sources = [(len(hot), lambda: hot)]
+        for _, count, path in reversed(self.segments(user_number)):
+            sources.append((count, lambda path=path: self.read_segment(path)))
+        for count, load in sources:
+            if needed is not None and seen >= needed:
+                break
+            if seen + count <= skip_recent:
+                seen += count
+                continue
+            if newest_kept is None:
+                newest_kept = seen
+            chunks.append(load())
+            seen += count
+        history = [message for chunk in reversed(chunks) for message in chunk]
+        end = len(history) - (skip_recent - newest_kept if newest_kept is not None else 0)
+        if end <= 0:
+            return []
+        return history[max(0, end - limit) if limit else 0:end]
+
+    def reset(self, user_number, history):
+        self.delete(user_number)
+        os.makedirs(self.user_dir(user_number), exist_ok=True)
+        self.write_hot(user_number, list(history))
+        self.roll(user_number)
+
+    def delete(self, user_number):
+        self.hot_counts.pop(user_number, None)
+        self.checked.discard(user_number)
+        shutil.rmtree(self.user_dir(user_number), ignore_errors=True)
+
+    # Advisory lock on the whole archive: processes serving users hold it shared, maintenance
+    # that rewrites hot logs holds it exclusively. False if another process holds it in conflict.
+    def lock(self, exclusive=False):
+        if fcntl is None:
+            return True
+        if self.lock_file is None:
+            os.makedirs(self.root, exist_ok=True)
+            self.lock_file = open(os.path.join(self.root, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self.lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def close(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def disk_usage(self, user_number):
+        user_dir = self.user_dir(user_number)
+        if not os.path.isdir(user_dir):
+            return 0
+        return sum(os.path.getsize(os.path.join(user_dir, name)) for name in os.listdir(user_dir))
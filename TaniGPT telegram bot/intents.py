@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Intent routing settings
+INTENTS_FILE = os.environ.get("INTENTS_FILE", "intents.json")
+INTENTS_RELOAD_INTERVAL = float(os.environ.get("INTENTS_RELOAD_INTERVAL", 5))
+
+
+def date_reply(route, message):
+    return datetime.now().strftime("Today is %A, %B %d, %Y")
+
+
+def static_reply(route, message):
+    return route.response
+
+
+# Handlers a route can name in intents.json; routes with only a "response" use static_reply
+HANDLERS = {
+    "date": date_reply,
+    "static": static_reply,
+}
+
+
+class Route:
+    def __init__(self, name, keywords, handler, emoji=None, response=None):
+        self.name = name
+        self.keywords = keywords
+        self.handler = handler
+        self.emoji = emoji
+        self.response = response
+
+    def answer(self, message):
+        return self.handler(self, message)
+
+
+class IntentRouter:
+    """Keyword routes compiled into one regex; earlier routes in the table win.
+
+    The table is read on the first match(), not on construction, so importing the bot does no
+    file I/O for it.
+    """
+
+    def __init__(self, path=INTENTS_FILE, reload_interval=INTENTS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.routes = []
+        self.pattern = None
+        self.mtime = None
+        self.next_check = 0.0
+        self.loaded = False
+
+    def compile(self, table):
+        routes = []
+        for entry in table:
+            handler_name = entry.get("handler", "static")
+            if handler_name not in HANDLERS:
+                raise ValueError(f"Intent '{entry['name']}' uses unknown handler '{handler_name}'")
+            routes.append(Route(
+                entry['name'],
+                [keyword.lower() for keyword in entry['keywords']],
+                HANDLERS[handler_name],
+                entry.get("emoji"),
+                entry.get("response")
+            ))
+        # Longest keywords first so a phrase wins over a word it contains
+        alternatives = []
+        for index, route in enumerate(routes):
+            keywords = sorted(route.keywords, key=len, reverse=True)
+            alternatives.append(f"(?P<r{index}>{'|'.join(re.escape(keyword) for keyword in keywords)})")
+        pattern = re.compile("|".join(alternatives)) if alternatives else None
+        return routes, pattern
+
+    def reload(self):
+        self.loaded = True
+        if not os.path.exists(self.path):
+            logger.warning(f"Intents file {self.path} not found, local intents disabled")
+            self.routes, self.pattern, self.mtime = [], None, None
+            return
+        mtime = os.path.getmtime(self.path)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                routes, pattern = self.compile(json.load(f))
+        except Exception as e:
+            # Keep serving the previous table if the edited file is broken
+            logger.error(f"Failed to load intents from {self.path}: {str(e)}")
+            self.mtime = mtime
+            return
+        self.routes, self.pattern, self.mtime = routes, pattern, mtime
+        logger.info(f"Loaded {len(routes)} intents from {self.path}")
+
+    def maybe_reload(self):
+        now = time.time()
+        if self.loaded and now < self.next_check:
+            return
+        self.next_check = now + self.reload_interval
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if not self.loaded or mtime != self.mtime:
+            self.reload()
+
+    # Single pass over the message; returns the highest-priority matching Route or None
+    def match(self, message):
+        self.maybe_reload()
+        if self.pattern is None:
+            return None
+        best = None
+        for found in self.pattern.finditer(message.lower()):
+            index = int(found.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return self.routes[best] if best is not None else None
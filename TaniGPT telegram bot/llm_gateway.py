@@ -0,0 +1,324 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import AsyncExitStack
+
+import httpx
+
+import metrics
+from rate_limit import QueueTimeout, is_rate_limited, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Gateway settings (LLM_TIMEOUT bounds one attempt, LLM_DEADLINE the whole request with retries)
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "mistral-small-latest")
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 45))
+LLM_RETRY_BASE = float(os.environ.get("LLM_RETRY_BASE", 0.5))
+LLM_RETRY_MAX = float(os.environ.get("LLM_RETRY_MAX", 8))
+# Send a second, hedged request once the first has taken longer than this latency percentile
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 16))
+LLM_KEEPALIVE = float(os.environ.get("LLM_KEEPALIVE", 60))
+
+
+class LLMUnavailable(Exception):
+    """Every model's circuit breaker is open."""
+
+
+# Worth another try: provider overload, server errors, timeouts and dropped connections
+def is_retryable(error):
+    if isinstance(error, QueueTimeout):
+        return False
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return is_rate_limited(error) or status_code >= 500
+    return isinstance(error, (asyncio.TimeoutError, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after the cooldown one trial request may go through."""
+
+    def __init__(self, name, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed again")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+    # A trial that ended without telling us anything (cancelled, or a non-retryable error)
+    def release(self):
+        self.trial_running = False
+
+
+class LLMGateway:
+    """All Mistral traffic: pooled connections, deadlines, jittered retries, hedging,
+    a fallback model and per-model circuit breakers, behind the fair scheduler."""
+
+    def __init__(self, api_key, scheduler, model, timeout, fallback_model=LLM_FALLBACK_MODEL,
+                 retries=2, deadline=LLM_DEADLINE, hedge=LLM_HEDGE):
+        self.api_key = api_key
+        self.scheduler = scheduler
+        self.models = [model] + ([fallback_model] if fallback_model and fallback_model != model else [])
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = deadline
+        self.hedge = hedge
+        self.breakers = {name: CircuitBreaker(name) for name in self.models}
+        # Recent latencies of the primary model, for the hedging threshold
+        self.latencies = deque(maxlen=500)
+        self.http_client = None
+        self._client = None
+        self.client_lock = threading.Lock()
+
+    # Created on first use, sharing one keep-alive connection pool across all requests.
+    # The SDK is imported here too: its models take longer to import than the rest of the bot.
+    @property
+    def client(self):
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    from mistralai import Mistral
+                    self.http_client = httpx.AsyncClient(
+                        limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                                            keepalive_expiry=LLM_KEEPALIVE)
+                    )
+                    self._client = Mistral(api_key=self.api_key, async_client=self.http_client)
+                    logger.info("Mistral AI client initialized")
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    async def close(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    @property
+    def open_circuits(self):
+        return sum(1 for breaker in self.breakers.values() if breaker.state == "open")
+
+    def hedge_delay(self):
+        if not self.hedge or len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * LLM_HEDGE_PERCENTILE / 100))]
+
+    def backoff(self, attempt, deadline):
+        # Full jitter keeps retries from many users from arriving in lockstep
+        delay = random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+        return max(0.0, min(delay, deadline - time.monotonic()))
+
+    # Note the outcome of a failed attempt; returns True if it is worth retrying
+    async def handle_failure(self, error, model, attempt, deadline):
+        if isinstance(error, QueueTimeout):
+            # Our own queue was too long; the provider never saw the request
+            metrics.llm_errors.inc("queue_timeout")
+            return False
+        if is_rate_limited(error):
+            metrics.llm_errors.inc("rate_limited")
+        elif isinstance(error, asyncio.TimeoutError):
+            metrics.llm_errors.inc("timeout")
+        else:
+            metrics.llm_errors.inc("error")
+        if not is_retryable(error):
+            return False
+        self.breakers[model].record_failure()
+        if is_rate_limited(error):
+            # Back off globally and queue up again behind the other users
+            self.scheduler.throttled(retry_after(error))
+        elif attempt < self.retries:
+            await asyncio.sleep(self.backoff(attempt, deadline))
+        return attempt < self.retries and time.monotonic() < deadline and self.breakers[model].allow()
+
+    async def request(self, model, messages, user_key, deadline):
+        async with self.scheduler.slot(user_key, timeout=max(0.0, deadline - time.monotonic())):
+            timeout = max(0.0, min(self.timeout, deadline - time.monotonic()))
+            start_time = time.time()
+            result = await asyncio.wait_for(
+                self.client.chat.complete_async(model=model, messages=messages, timeout_ms=int(timeout * 1000)),
+                timeout=timeout
+            )
+            end_time = time.time()
+        if model == self.models[0]:
+            self.latencies.append(end_time - start_time)
+        metrics.llm_latency.observe(end_time - start_time, "complete")
+        logger.info(f"Mistral AI response time ({model}): {end_time - start_time:.2f} seconds")
+        return result.choices[0].message.content
+
+    # One attempt, plus a hedged duplicate if it runs past the latency percentile
+    async def hedged_request(self, model, messages, user_key, deadline):
+        delay = self.hedge_delay() if model == self.models[0] else None
+        if delay is None:
+            return await self.request(model, messages, user_key, deadline)
+        tasks = [asyncio.ensure_future(self.request(model, messages, user_key, deadline))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                metrics.llm_hedges.inc()
+                tasks.append(asyncio.ensure_future(self.request(model, messages, user_key, deadline)))
+            error = None
+            # First success wins; only fail once every copy has failed, with a provider error if there was one
+            for future in asyncio.as_completed(tasks):
+                try:
+                    return await future
+                except Exception as e:
+                    if error is None or not isinstance(e, QueueTimeout):
+                        error = e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, messages, user_key=None):
+        deadline = time.monotonic() + self.deadline
+        error = None
+        for model in self.models:
+            if time.monotonic() >= deadline:
+                break
+            breaker = self.breakers[model]
+            trial = breaker.state == "half_open"
+            if not breaker.allow():
+                continue
+            if model != self.models[0]:
+                metrics.llm_fallbacks.inc()
+                logger.warning(f"Falling back to {model}")
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        response = await self.hedged_request(model, messages, user_key, deadline)
+                    except Exception as e:
+                        error = e
+                        if await self.handle_failure(e, model, attempt, deadline):
+                            continue
+                        if not is_retryable(e):
+                            raise
+                        break
+                    breaker.record_success()
+                    self.scheduler.recovered()
+                    return response
+            finally:
+                # However the trial ended, the next caller may try again
+                if trial:
+                    breaker.release()
+        if error is not None:
+            raise error
+        raise LLMUnavailable("All models are unavailable")
+
+    # Open a stream on the first model that answers, holding an LLM slot until the caller closes it
+    async def open_stream(self, messages, user_key, deadline):
+        error = None
+        for model in self.models:
+            if time.monotonic() >= deadline:
+                break
+            breaker = self.breakers[model]
+            trial = breaker.state == "half_open"
+            if not breaker.allow():
+                continue
+            if model != self.models[0]:
+                metrics.llm_fallbacks.inc()
+                logger.warning(f"Falling back to {model}")
+            try:
+                for attempt in range(self.retries + 1):
+                    slot = AsyncExitStack()
+                    try:
+                        await slot.enter_async_context(
+                            self.scheduler.slot(user_key, timeout=max(0.0, deadline - time.monotonic()))
+                        )
+                    except QueueTimeout:
+                        metrics.llm_errors.inc("queue_timeout")
+                        raise
+                    try:
+                        timeout = max(0.0, min(self.timeout, deadline - time.monotonic()))
+                        stream = await asyncio.wait_for(
+                            self.client.chat.stream_async(model=model, messages=messages,
+                                                          timeout_ms=int(timeout * 1000)),
+                            timeout=timeout
+                        )
+                    except BaseException as e:
+                        await slot.aclose()
+                        if not isinstance(e, Exception):
+                            raise
+                        error = e
+                        if await self.handle_failure(e, model, attempt, deadline):
+                            continue
+                        if not is_retryable(e):
+                            raise
+                        break
+                    breaker.record_success()
+                    self.scheduler.recovered()
+                    return slot, stream
+            finally:
+                if trial:
+                    breaker.release()
+        if error is not None:
+            raise error
+        raise LLMUnavailable("All models are unavailable")
+
+    # Yields text deltas as they arrive; retries and fallback only apply before the first one
+    async def stream(self, messages, user_key=None):
+        deadline = time.monotonic() + self.deadline
+        start_time = time.time()
+        first_token_time = None
+        slot, stream = await self.open_stream(messages, user_key, deadline)
+        async with slot, stream:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                if not chunk.data.choices:
+                    continue
+                delta = chunk.data.choices[0].delta.content
+                if not isinstance(delta, str) or not delta:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    metrics.llm_first_token.observe(first_token_time - start_time)
+                    logger.info(f"Mistral AI time to first token: {first_token_time - start_time:.2f} seconds")
+                yield delta
+        end_time = time.time()
+        metrics.llm_latency.observe(end_time - start_time, "stream")
+        logger.info(f"Mistral AI response time: {end_time - start_time:.2f} seconds")
@@ -1,20 +1,31 @@
 import os
+import asyncio
 import logging
 import time
-import json
-from datetime import datetime
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    CallbackQueryHandler,
     ConversationHandler,
     filters,
     ContextTypes,
 )
-from telegram.constants import ChatAction
-from mistralai import Mistral
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+from storage import get_storage, check_backend, LazyStorage, PhoneNumberTaken, STORAGE_BACKEND
+from session_cache import SessionCache
+from response_cache import ResponseCache
+from intents import IntentRouter
+from rate_limit import FairScheduler, UserRateLimiter, is_rate_limited
+from llm_gateway import LLMGateway, LLMUnavailable
+import metrics
+from metrics import timed_handler
+from context_window import ContextWindow, CONTEXT_MAX_MESSAGES, CONTEXT_SUMMARY, CONTEXT_SUMMARY_MIN_MESSAGES
+from cluster import serve_worker
+from persistence import JsonPersistence, WARM_START_SESSIONS
 
 # Setup logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -35,26 +46,49 @@ if not MISTRAL_API_KEY or not TELEGRAM_BOT_TOKEN:
 # Admin user ID
 ADMIN_USER_ID = "5842560424"
 
-# Mistral AI client
+# Mistral AI model (LLM_FALLBACK_MODEL takes over while it is failing)
 MODEL = "mistral-large-latest"
-try:
-    mistral_client = Mistral(api_key=MISTRAL_API_KEY)
-    logger.info("Mistral AI client initialized")
-except Exception as e:
-    logger.error(f"Failed to initialize Mistral client: {str(e)}")
-    raise
-
-# User data directory
-USER_DATA_DIR = "user_data"
-if not os.path.exists(USER_DATA_DIR):
-    os.makedirs(USER_DATA_DIR)
-
-# User index file
-USER_INDEX_FILE = "user_index.json"
-user_index = {}
-if os.path.exists(USER_INDEX_FILE):
-    with open(USER_INDEX_FILE, 'r') as f:
-        user_index = json.load(f)
+
+# LLM concurrency and timeout settings
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 30))
+# Updates handled in parallel; per-user state only changes under that user's session.lock
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 64))
+
+# Set by the cluster supervisor (python manage.py cluster): take updates from the ingress on this port
+WORKER_PORT = int(os.environ.get("WORKER_PORT", 0))
+# Retries per model for rate limits, server errors and timeouts, within LLM_DEADLINE
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", os.environ.get("LLM_RATE_LIMIT_RETRIES", 2)))
+
+# Admission control: per-user token buckets, and LLM slots shared round-robin across users
+user_rate_limiter = UserRateLimiter()
+llm_scheduler = FairScheduler(LLM_MAX_CONCURRENCY)
+
+# All Mistral calls: pooled connections, retries, hedging, fallback model and circuit breakers
+llm_gateway = LLMGateway(MISTRAL_API_KEY, llm_scheduler, MODEL, LLM_TIMEOUT, retries=LLM_RETRIES)
+
+# Streaming settings (Telegram allows roughly one edit per second per chat)
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "false").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.5))
+
+# Wait this long after a message for more before answering (0 answers right away)
+MESSAGE_DEBOUNCE_MS = float(os.environ.get("MESSAGE_DEBOUNCE_MS", 0))
+
+# Open storage and the Mistral client in the background right after startup
+# (false: only when the first update needs them)
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"
+
+# User storage (STORAGE_BACKEND=json, archive or sqlite): the name is checked now, the backend
+# is opened on first use
+check_backend(STORAGE_BACKEND)
+storage = LazyStorage(lambda: metrics.instrument_storage(get_storage(STORAGE_BACKEND)))
+
+# In-memory sessions for active users, written behind to storage
+session_cache = SessionCache(storage, history_limit=CONTEXT_MAX_MESSAGES)
+
+# Conversation states and user_data survive restarts; the hottest sessions are preloaded on start
+persistence = JsonPersistence(hot_sessions=lambda: session_cache.hot_ids(WARM_START_SESSIONS))
+warm_start_task = None
 
 # System prompt
 SYSTEM_PROMPT = (
@@ -63,42 +97,137 @@ SYSTEM_PROMPT = (
     "Keep responses relevant and engaging."
 )
 
+# Token-budgeted prompt builder, SYSTEM_PROMPT is always pinned
+context_window = ContextWindow(SYSTEM_PROMPT)
+
+# Opt-in cache of LLM replies (RESPONSE_CACHE=true)
+response_cache = ResponseCache()
+
+# Locally answered intents from intents.json, read on the first message and reloaded when the file changes
+intent_router = IntentRouter()
+
+# Gauges read at scrape time
+metrics.registry.gauge("tanigpt_llm_in_flight", "Mistral requests in flight", lambda: llm_scheduler.active)
+metrics.registry.gauge("tanigpt_llm_queue_depth", "Requests waiting for an LLM slot", lambda: llm_scheduler.queue_depth)
+metrics.registry.gauge("tanigpt_llm_open_circuits", "Models whose circuit breaker is open",
+                       lambda: llm_gateway.open_circuits)
+metrics.registry.gauge("tanigpt_active_sessions", "Sessions held in memory", lambda: len(session_cache.sessions))
+metrics.registry.counter("tanigpt_response_cache_hits_total", "Response cache hits, exact and similar",
+                         lambda: response_cache.hits + response_cache.similar_hits)
+metrics.registry.counter("tanigpt_response_cache_misses_total", "Response cache misses",
+                         lambda: response_cache.misses)
+metrics.registry.gauge("tanigpt_response_cache_hit_ratio", "Response cache hit ratio",
+                       lambda: response_cache.stats()['hit_rate'])
+metrics_server = None
+
 # Signup states
 NAME, PHONE = range(2)
 
 # Admin panel states
 PASSWORD, MENU, VIEW_HISTORY, DELETE_USER = range(4)
 
+ADMIN_KEYBOARD = [
+    ["Users", "History"],
+    ["Delete User", "Stats"],
+    ["Exit"]
+]
+
+# Admin browsing page sizes (users per listing page, chat messages per history page)
+ADMIN_USERS_PAGE_SIZE = int(os.environ.get("ADMIN_USERS_PAGE_SIZE", 10))
+ADMIN_HISTORY_PAGE_SIZE = int(os.environ.get("ADMIN_HISTORY_PAGE_SIZE", 20))
+
 # Emoji selection based on context
+EMOJI_MAP = {
+    "welcome": ["😎", "🚀", "✨"],
+    "error": ["😬", "😅", "🙈"],
+    "admin": ["👑", "😎", "🔐"],
+    "success": ["✅", "🎉", "👍"],
+    "general": ["😊", "👍", "🤗"],
+}
+
 def get_emoji(context_type, message_content=""):
-    emoji_map = {
-        "welcome": ["😎", "🚀", "✨"],
-        "error": ["😬", "😅", "🙈"],
-        "admin": ["👑", "😎", "🔐"],
-        "success": ["✅", "🎉", "👍"],
-        "general": ["😊", "👍", "🤗"],
-        "date": ["📅", "🕒"],
-        "tanishk": ["🎤", "🎵"]
-    }
-    if context_type == "general" and "date" in message_content.lower():
-        return emoji_map["date"][0]
-    if context_type == "general" and "tanishk sharma" in message_content.lower():
-        return emoji_map["tanishk"][0]
-    return emoji_map.get(context_type, ["😊"])[0]
+    if context_type == "general" and message_content:
+        route = intent_router.match(message_content)
+        if route and route.emoji:
+            return route.emoji
+    return EMOJI_MAP.get(context_type, ["😊"])[0]
+
+# Edit a streamed message, skipping no-op edits and honouring flood control
+async def edit_streamed_message(message, text):
+    try:
+        await message.edit_text(text)
+    except RetryAfter as e:
+        logger.warning(f"Telegram flood control, retrying edit after {e.retry_after} seconds")
+        return e.retry_after
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    return 0
+
+# Stream a reply into one Telegram message with rate-limited edits
+async def stream_reply(update: Update, messages, user_name, emoji, user_key=None):
+    prefix = f"Hlo {user_name}, "
+    limit = MessageLimit.MAX_TEXT_LENGTH
+    response = ""
+    sent_message = None
+    next_edit_time = 0.0
+    shown_text = ""
+
+    async for delta in llm_gateway.stream(messages, user_key):
+        response += delta
+        text = (prefix + response)[:limit]
+        now = time.time()
+        if sent_message is None:
+            sent_message = await update.message.reply_text(text)
+            shown_text = text
+            next_edit_time = now + STREAM_EDIT_INTERVAL
+        elif now >= next_edit_time and text != shown_text:
+            delay = await edit_streamed_message(sent_message, text)
+            if not delay:
+                shown_text = text
+            next_edit_time = now + max(STREAM_EDIT_INTERVAL, delay)
+
+    final_text = f"{prefix}{response} {emoji}"
+    if sent_message is None:
+        await update.message.reply_text(final_text[:limit])
+    elif final_text[:limit] != shown_text:
+        delay = await edit_streamed_message(sent_message, final_text[:limit])
+        if delay:
+            await asyncio.sleep(delay)
+            await edit_streamed_message(sent_message, final_text[:limit])
+    # Whatever did not fit into the first message goes out as follow-ups
+    for i in range(limit, len(final_text), limit):
+        await update.message.reply_text(final_text[i:i + limit])
+    return response
+
+# Fold turns that no longer fit the context window into the session's rolling summary
+async def refresh_summary(session, dropped_turns):
+    try:
+        session.summary = await llm_gateway.complete(
+            context_window.summary_request(dropped_turns, session.summary),
+            session.user_number
+        )
+    except Exception as e:
+        logger.error(f"Failed to summarize history for user {session.user_number}: {str(e)}")
+        return
+    # Keep what came after the newest summarized turn (the history limit may have trimmed some already)
+    turns = [message for message in session.history if message['role'] != 'system']
+    last = dropped_turns[-1]
+    cut = next((index + 1 for index, message in enumerate(turns) if message is last), 0)
+    session.history = turns[cut:]
+    logger.info(f"Summarized {len(dropped_turns)} older messages for user {session.user_number}")
 
 # Telegram bot handlers
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     logger.info(f"Received /start command from user {user_id}")
 
-    if user_id in user_index:
-        user_number = user_index[user_id]['user_number']
-        user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-        with open(user_file, 'r') as f:
-            user_data = json.load(f)
+    session = await session_cache.get(user_id)
+    if session:
         welcome_message = (
-            f"Hlo {user_data['name']}, welcome back to TaniGPT! "
-            f"Apka user number hai {user_number}. Chalo, kya baat karna hai? {get_emoji('welcome')}"
+            f"Hlo {session.name}, welcome back to TaniGPT! "
+            f"Apka user number hai {session.user_number}. Chalo, kya baat karna hai? {get_emoji('welcome')}"
         )
         await update.message.reply_text(welcome_message)
         return ConversationHandler.END
@@ -109,6 +238,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return NAME
 
+@timed_handler
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     name = update.message.text.strip()
@@ -125,6 +255,7 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return PHONE
 
+@timed_handler
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     phone = update.message.text.strip()
@@ -140,45 +271,43 @@ async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     formatted_phone = f"+91{phone}"
     logger.info(f"Formatted phone number for user {user_id}: {formatted_phone}")
 
-    for uid, data in user_index.items():
-        user_file = os.path.join(USER_DATA_DIR, f"user_{data['user_number']}.json")
-        with open(user_file, 'r') as f:
-            user_data = json.load(f)
-        if user_data['phone_number'] == formatted_phone:
-            await update.message.reply_text(
-                f"Yeh number (+91{phone}) toh pehle se hai! {get_emoji('error')} Koi naya number try karo!"
-            )
-            return PHONE
-
-    user_number = str(len(user_index) + 1)
-    user_index[user_id] = {'user_number': user_number}
-
-    user_data = {
-        'name': context.user_data['name'],
-        'phone_number': formatted_phone,
-        'chat_history': [{"role": "system", "content": SYSTEM_PROMPT}]
-    }
-    user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-    with open(user_file, 'w') as f:
-        json.dump(user_data, f, indent=4)
-
-    with open(USER_INDEX_FILE, 'w') as f:
-        json.dump(user_index, f, indent=4)
-    logger.info(f"User {user_id} signed up with user number {user_number}: {user_data}")
+    try:
+        user_number = await asyncio.to_thread(
+            storage.create_user,
+            user_id,
+            context.user_data['name'],
+            formatted_phone,
+            [{"role": "system", "content": SYSTEM_PROMPT}]
+        )
+    except PhoneNumberTaken:
+        await update.message.reply_text(
+            f"Yeh number (+91{phone}) toh pehle se hai! {get_emoji('error')} Koi naya number try karo!"
+        )
+        return PHONE
+    logger.info(f"User {user_id} signed up with user number {user_number}: {context.user_data['name']}, {formatted_phone}")
 
     welcome_message = (
         f"Hlo {context.user_data['name']}, signup ho gaya, swagat hai TaniGPT mein! "
         f"Apka user number hai {user_number}. Ab bol, kya scene hai? {get_emoji('welcome')}"
     )
     await update.message.reply_text(welcome_message)
+    end_signup(update, context)
     return ConversationHandler.END
 
 async def cancel_signup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         f"Signup cancel kar diya, bro! {get_emoji('success')} Dobara try karo with /start!"
     )
+    end_signup(update, context)
     return ConversationHandler.END
 
+# The name is only needed during signup; drop it, and the user's user_data if nothing else is
+# left, so the persisted state doesn't grow with every user who ever signed up
+def end_signup(update, context):
+    context.user_data.pop('name', None)
+    if not context.user_data:
+        context.application.drop_user_data(update.message.from_user.id)
+
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     logger.info(f"Received /admin command from user {user_id}")
@@ -203,11 +332,7 @@ async def check_admin_password(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return PASSWORD
 
-    keyboard = [
-        ["Users", "History"],
-        ["Delete User", "Exit"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    reply_markup = ReplyKeyboardMarkup(ADMIN_KEYBOARD, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text(
         f"Welcome to TaniGPT Admin Panel, boss! {get_emoji('admin')} Kya karna hai?",
         reply_markup=reply_markup
@@ -227,21 +352,11 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     elif choice == "Users":
-        if not user_index:
+        if await asyncio.to_thread(storage.count_users) == 0:
             await update.message.reply_text(f"Abhi koi users nahi hain, bro! {get_emoji('error')}")
         else:
-            user_list = "Registered Users:\n"
-            for uid, data in user_index.items():
-                user_file = os.path.join(USER_DATA_DIR, f"user_{data['user_number']}.json")
-                with open(user_file, 'r') as f:
-                    user_data = json.load(f)
-                user_list += (
-                    f"User Number: {data['user_number']}\n"
-                    f"Telegram ID: {uid}\n"
-                    f"Name: {user_data['name']}\n"
-                    f"Phone: {user_data['phone_number']}\n\n"
-                )
-            await update.message.reply_text(user_list)
+            user_list, page_markup = await render_users_page(0)
+            await update.message.reply_text(user_list, reply_markup=page_markup)
 
     elif choice == "History":
         await update.message.reply_text(f"Kis user ka history dekhna hai? User number daal do: {get_emoji('admin')}")
@@ -251,46 +366,132 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Kis user ko delete karna hai? User number daal do: {get_emoji('admin')}")
         return DELETE_USER
 
-    keyboard = [
-        ["Users", "History"],
-        ["Delete User", "Exit"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    elif choice == "Stats":
+        cache_stats = response_cache.stats()
+        await update.message.reply_text(
+            f"Bot Stats {get_emoji('admin')}\n"
+            f"Active sessions: {len(session_cache.sessions)}\n"
+            f"LLM requests: {llm_scheduler.active} in flight, {llm_scheduler.queue_depth} queued\n"
+            f"Response cache: {'on' if cache_stats['enabled'] else 'off'}, {cache_stats['entries']} entries\n"
+            f"Cache hits: {cache_stats['hits']} exact, {cache_stats['similar_hits']} similar, "
+            f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)"
+        )
+
+    reply_markup = ReplyKeyboardMarkup(ADMIN_KEYBOARD, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text(f"Ab kya karna hai, boss? {get_emoji('admin')}", reply_markup=reply_markup)
     return MENU
 
+# Split rendered parts into Telegram-sized messages, breaking inside a part only if it alone is too long
+def chunk_text(parts, limit=MessageLimit.MAX_TEXT_LENGTH):
+    chunks = []
+    current = ""
+    for part in parts:
+        if current and len(current) + len(part) > limit:
+            chunks.append(current)
+            current = ""
+        while len(part) > limit:
+            chunks.append(part[:limit])
+            part = part[limit:]
+        current += part
+    if current:
+        chunks.append(current)
+    return chunks
+
+def shorten(text, limit):
+    return text if len(text) <= limit else text[:max(0, limit - 1)] + "…"
+
+def page_buttons(back, forward):
+    buttons = [InlineKeyboardButton(label, callback_data=data) for label, data in (back, forward) if data]
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+# One page of the user listing, read from the profile index only
+async def render_users_page(page):
+    total = await asyncio.to_thread(storage.count_users)
+    pages = max(1, -(-total // ADMIN_USERS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    profiles = await asyncio.to_thread(storage.list_profiles, page * ADMIN_USERS_PAGE_SIZE, ADMIN_USERS_PAGE_SIZE)
+    user_list = f"Registered Users ({total}), page {page + 1}/{pages}:\n\n"
+    entries = [
+        (
+            f"User Number: {profile['user_number']}\nTelegram ID: {profile['telegram_id']}\nName: ",
+            profile['name'],
+            f"\nPhone: {profile['phone_number']}\n\n"
+        )
+        for profile in profiles
+    ]
+    # Pages are edited in place, so one has to fit one message: long names share what is left
+    fixed = len(user_list) + sum(len(before) + len(after) for before, _, after in entries)
+    name_limit = (MessageLimit.MAX_TEXT_LENGTH - fixed) // max(1, len(entries))
+    for before, name, after in entries:
+        user_list += before + shorten(name, name_limit) + after
+    user_list = shorten(user_list, MessageLimit.MAX_TEXT_LENGTH)
+    reply_markup = page_buttons(
+        ("⬅️ Prev", f"users:{page - 1}" if page > 0 else None),
+        ("Next ➡️", f"users:{page + 1}" if page < pages - 1 else None)
+    )
+    return user_list, reply_markup
+
+# Send one page of a user's history, newest page first, split across messages as needed
+async def send_history_page(message, user_number, user_data, skip_recent):
+    batch = await asyncio.to_thread(storage.get_history, user_number, ADMIN_HISTORY_PAGE_SIZE + 1, skip_recent)
+    has_older = len(batch) > ADMIN_HISTORY_PAGE_SIZE
+    turns = [msg for msg in batch[-ADMIN_HISTORY_PAGE_SIZE:] if msg['role'] != 'system']
+    if not turns and skip_recent == 0:
+        await message.reply_text(f"User {user_number} ka koi history nahi hai, boss! {get_emoji('error')}")
+        return
+
+    parts = [
+        f"Chat History for User {user_number} ({user_data['name']}), "
+        f"messages {skip_recent + 1}-{skip_recent + min(len(batch), ADMIN_HISTORY_PAGE_SIZE)} from the latest:\n\n"
+    ]
+    for msg in turns:
+        role = "User" if msg['role'] == 'user' else "TaniGPT"
+        parts.append(f"{role}: {msg['content']}\n\n")
+    chunks = chunk_text(parts)
+    reply_markup = page_buttons(
+        ("⬅️ Older", f"history:{user_number}:{skip_recent + ADMIN_HISTORY_PAGE_SIZE}" if has_older else None),
+        ("Newer ➡️", f"history:{user_number}:{max(0, skip_recent - ADMIN_HISTORY_PAGE_SIZE)}" if skip_recent else None)
+    )
+    for chunk in chunks[:-1]:
+        await message.reply_text(chunk)
+    await message.reply_text(chunks[-1], reply_markup=reply_markup)
+
+async def admin_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_list, reply_markup = await render_users_page(int(query.data.split(":")[1]))
+    await query.edit_message_text(user_list, reply_markup=reply_markup)
+    return MENU
+
+async def admin_history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, user_number, skip_recent = query.data.split(":")
+    user_data = await asyncio.to_thread(storage.get_user, user_number)
+    # Same view of the history as the first page, so page offsets line up
+    await session_cache.flush()
+    # The new page is sent below the old one, so drop the old page's buttons
+    await query.edit_message_reply_markup(reply_markup=None)
+    if user_data is None:
+        await query.message.reply_text(f"Yeh user number galat hai, bro! {get_emoji('error')}")
+        return MENU
+    await send_history_page(query.message, user_number, user_data, int(skip_recent))
+    return MENU
+
 async def view_user_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     user_number = update.message.text.strip()
     logger.info(f"Received user number {user_number} for history from user {user_id}")
 
-    user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-    if not os.path.exists(user_file):
+    user_data = await asyncio.to_thread(storage.get_user, user_number)
+    if user_data is None:
         await update.message.reply_text(f"Yeh user number galat hai, bro! {get_emoji('error')}")
         return MENU
 
-    with open(user_file, 'r') as f:
-        user_data = json.load(f)
+    await session_cache.flush()
+    await send_history_page(update.message, user_number, user_data, 0)
 
-    history = user_data.get('chat_history', [])
-    if len(history) <= 1:
-        await update.message.reply_text(
-            f"User {user_number} ka koi history nahi hai, boss! {get_emoji('error')}"
-        )
-    else:
-        history_text = f"Chat History for User {user_number} ({user_data['name']}):\n\n"
-        for msg in history:
-            if msg['role'] == 'system':
-                continue
-            role = "User" if msg['role'] == 'user' else "TaniGPT"
-            history_text += f"{role}: {msg['content']}\n\n"
-        await update.message.reply_text(history_text)
-
-    keyboard = [
-        ["Users", "History"],
-        ["Delete User", "Exit"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    reply_markup = ReplyKeyboardMarkup(ADMIN_KEYBOARD, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text(f"Ab kya karna hai, boss? {get_emoji('admin')}", reply_markup=reply_markup)
     return MENU
 
@@ -299,30 +500,13 @@ async def delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_number = update.message.text.strip()
     logger.info(f"Received user number {user_number} for deletion from user {user_id}")
 
-    user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-    if not os.path.exists(user_file):
+    if not await session_cache.delete_user(user_number):
         await update.message.reply_text(f"Yeh user number galat hai, bro! {get_emoji('error')}")
         return MENU
 
-    user_id_to_delete = None
-    for uid, data in list(user_index.items()):
-        if data['user_number'] == user_number:
-            user_id_to_delete = uid
-            break
-
-    if user_id_to_delete:
-        del user_index[user_id_to_delete]
-        with open(USER_INDEX_FILE, 'w') as f:
-            json.dump(user_index, f, indent=4)
-
-    os.remove(user_file)
     await update.message.reply_text(f"User {user_number} delete ho gaya, boss! {get_emoji('success')}")
 
-    keyboard = [
-        ["Users", "History"],
-        ["Delete User", "Exit"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+    reply_markup = ReplyKeyboardMarkup(ADMIN_KEYBOARD, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text(f"Ab kya karna hai, boss? {get_emoji('admin')}", reply_markup=reply_markup)
     return MENU
 
@@ -342,88 +526,189 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(about_text, parse_mode="Markdown")
 
+@timed_handler
 async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     logger.info(f"Clearing history for user {user_id}")
 
-    if user_id not in user_index:
+    session = await session_cache.get(user_id)
+    if not session:
         await update.message.reply_text(f"Pehle signup karo, bro! {get_emoji('error')} Use /start.")
         return
 
-    user_number = user_index[user_id]['user_number']
-    user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-    with open(user_file, 'r') as f:
-        user_data = json.load(f)
-    user_data['chat_history'] = [{"role": "system", "content": SYSTEM_PROMPT}]
-    with open(user_file, 'w') as f:
-        json.dump(user_data, f, indent=4)
+    async with session.lock:
+        await session_cache.reset(session, [{"role": "system", "content": SYSTEM_PROMPT}])
     await update.message.reply_text(
-        f"Hlo {user_data['name']}, tera history clear ho gaya! {get_emoji('success')}"
+        f"Hlo {session.name}, tera history clear ho gaya! {get_emoji('success')}"
     )
 
+@timed_handler
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     user_message = update.message.text.lower().strip()
     logger.info(f"Received text from user {user_id}: {user_message}")
 
-    if user_id not in user_index:
+    if not user_rate_limiter.allow(user_id):
+        logger.warning(f"Rate limited user {user_id}, dropping message")
+        if user_rate_limiter.should_notify(user_id):
+            await update.message.reply_text(
+                f"Arre bro, itne saare messages ek saath! {get_emoji('error')} Thoda ruk ke bhejo."
+            )
+        return
+
+    session = await session_cache.get(user_id)
+    if not session:
         await update.message.reply_text(f"Pehle signup karo, bro! {get_emoji('error')} Use /start.")
         return
 
+    session.inbox.append(user_message)
+    session.inbox_seq += 1
+    seq = session.inbox_seq
+    # Newer input supersedes a reply that is still being generated; it is redone with both messages
+    if session.generation is not None and not session.generation.done():
+        session.superseded = True
+        session.generation.cancel()
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
 
-    user_number = user_index[user_id]['user_number']
-    user_file = os.path.join(USER_DATA_DIR, f"user_{user_number}.json")
-    with open(user_file, 'r') as f:
-        user_data = json.load(f)
-
-    user_name = user_data['name']
-    user_data['chat_history'].append({"role": "user", "content": user_message})
-
-    MAX_HISTORY = 10
-    if len(user_data['chat_history']) > MAX_HISTORY:
-        user_data['chat_history'] = user_data['chat_history'][-MAX_HISTORY:]
-
+    if MESSAGE_DEBOUNCE_MS > 0:
+        await asyncio.sleep(MESSAGE_DEBOUNCE_MS / 1000)
+        if session.inbox_seq != seq:
+            logger.info(f"Message from user {user_id} merged into a later one")
+            return
+
+    # One turn at a time per user, so history updates never interleave. Messages that
+    # queued up behind a running turn are answered together by the next one.
+    async with session.lock:
+        if not session.inbox:
+            logger.info(f"Message from user {user_id} was answered in a coalesced turn")
+            return
+        user_message = "\n".join(session.inbox)
+        session.inbox.clear()
+        await answer_message(update, session, user_message)
+
+# Run the completion as the session's cancellable generation; None if newer input superseded it
+async def generate(session, chat_history, user_message):
+    session.superseded = False
+    session.generation = asyncio.ensure_future(llm_gateway.complete(chat_history, session.user_number))
     try:
-        date_keywords = ["date", "today", "current date", "what's the date", "aaj ka din"]
-        tanishk_keywords = ["tanishk sharma", "who is tanishk"]
-        if any(keyword in user_message for keyword in date_keywords):
-            current_date = datetime.now().strftime("Today is %A, %B %d, %Y")
-            response = current_date
-            logger.info(f"Date query detected, responding: {response}")
-        elif any(keyword in user_message for keyword in tanishk_keywords):
-            response = (
-                "Tanishk Sharma is the Founder of Tnix AI. He is a music producer, casting director, singer, and writer. "
-                "His songs include 'Lost in My Feeling', '06 October Forever and Always', and 'WQAT'."
-            )
-            logger.info("Tanishk Sharma query detected, responding with predefined info")
+        return await session.generation
+    except asyncio.CancelledError:
+        if not session.superseded:
+            raise
+        # Hand the message back so the superseding turn answers it together with the new input
+        session.inbox.insert(0, user_message)
+        metrics.superseded_generations.inc()
+        logger.info(f"Generation for user {session.user_number} superseded by newer input")
+        return None
+    finally:
+        session.generation = None
+
+async def answer_message(update: Update, session, user_message):
+    user_name = session.name
+    user_turn = {"role": "user", "content": user_message}
+    turns = session.history + [user_turn]
+    chat_history, dropped = context_window.build(turns, session.summary)
+    # Taken now: appending the reply below trims session.history to the history limit
+    dropped_turns = [message for message in turns if message['role'] != 'system'][:dropped]
+
+    route = intent_router.match(user_message)
+    emoji = route.emoji if route and route.emoji else get_emoji("general")
+
+    streamed = False
+    try:
+        if route:
+            response = route.answer(user_message)
+            metrics.intent_hits.inc(route.name)
+            logger.info(f"Intent '{route.name}' detected, responding locally: {response}")
         else:
-            start_time = time.time()
-            response = mistral_client.chat.complete(
-                model=MODEL,
-                messages=user_data['chat_history']
-            ).choices[0].message.content
-            end_time = time.time()
-            logger.info(f"Mistral AI response time: {end_time - start_time:.2f} seconds")
-
-        user_data['chat_history'].append({"role": "assistant", "content": response})
-
-        with open(user_file, 'w') as f:
-            json.dump(user_data, f, indent=4)
+            # Keyed on the packed window before the prompt, so only identical contexts share replies
+            context = chat_history[:-1]
+            response = response_cache.get(user_message, context)
+            if response is not None:
+                logger.info(f"Response cache hit for user {session.user_number}")
+            else:
+                if STREAM_RESPONSES:
+                    # Streamed replies are already on screen, so they are not superseded
+                    response = await stream_reply(update, chat_history, user_name, emoji, session.user_number)
+                    streamed = True
+                else:
+                    response = await generate(session, chat_history, user_message)
+                    if response is None:
+                        return
+                # Replies that mention the user by name are not safe to share with others
+                if user_name.lower() not in response.lower():
+                    response_cache.put(user_message, context, response)
+
+        await session_cache.append(session, [user_turn, {"role": "assistant", "content": response}])
+
+        if not streamed:
+            personalized_response = f"Hlo {user_name}, {response} {emoji}"
+            await update.message.reply_text(personalized_response)
+
+        if CONTEXT_SUMMARY and dropped >= CONTEXT_SUMMARY_MIN_MESSAGES:
+            await refresh_summary(session, dropped_turns)
+
+    except LLMUnavailable:
+        # Circuit open on every model: answer right away instead of waiting on a degraded provider
+        metrics.llm_errors.inc("circuit_open")
+        logger.warning(f"Mistral AI unavailable, sent canned reply to user {session.telegram_id}")
+        emoji = get_emoji("error")
+        await update.message.reply_text(f"Hlo {user_name}, abhi AI thoda busy hai, ek minute baad try karo! {emoji}")
 
-        emoji = get_emoji("general", user_message)
-        personalized_response = f"Hlo {user_name}, {response} {emoji}"
-        await update.message.reply_text(personalized_response)
+    except asyncio.TimeoutError:
+        logger.error(f"Mistral AI timed out for user {session.telegram_id}")
+        emoji = get_emoji("error")
+        await update.message.reply_text(f"Hlo {user_name}, jawab aane mein bahut time lag gaya, dobara try karo! {emoji}")
 
     except Exception as e:
         logger.error(f"Error in text processing: {str(e)}")
         emoji = get_emoji("error")
-        await update.message.reply_text(f"Hlo {user_name}, kuch galat ho gaya: {str(e)} {emoji}")
+        if is_rate_limited(e):
+            await update.message.reply_text(f"Hlo {user_name}, abhi bahut traffic hai, thodi der baad try karo! {emoji}")
+        else:
+            await update.message.reply_text(f"Hlo {user_name}, kuch galat ho gaya, thodi der baad try karo! {emoji}")
+
+# Off the startup path: the bot already takes updates while this runs, and a handler that
+# gets there first just waits for the same load instead of starting another
+async def warm_up():
+    if STARTUP_WARMUP:
+        start_time = time.time()
+        await asyncio.to_thread(storage.load)
+        await asyncio.to_thread(lambda: llm_gateway.client)
+        logger.info(f"Storage and Mistral client ready {time.time() - start_time:.2f} seconds after startup")
+    if persistence.warm_sessions:
+        await session_cache.preload(persistence.warm_sessions)
+
+async def post_init(application: Application):
+    global metrics_server, warm_start_task
+    session_cache.start()
+    warm_start_task = asyncio.create_task(warm_up())
+    metrics_server = metrics.start_http_server()
+
+async def post_shutdown(application: Application):
+    if warm_start_task is not None:
+        warm_start_task.cancel()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    await session_cache.close()
+    await llm_gateway.close()
+    storage.close()
 
 def main():
     logger.info("Starting TaniGPT Bot...")
     try:
-        app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .persistence(persistence)
+        )
+        if WORKER_PORT:
+            # Updates arrive from the cluster ingress, not from getUpdates or Telegram directly
+            builder = builder.updater(None)
+        app = builder.build()
 
         # Signup conversation handler
         signup_handler = ConversationHandler(
@@ -433,6 +718,8 @@ def main():
                 PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
             },
             fallbacks=[CommandHandler("cancel", cancel_signup)],
+            name="signup",
+            persistent=True,
         )
 
         # Admin conversation handler
@@ -440,11 +727,17 @@ def main():
             entry_points=[CommandHandler("admin", admin_panel)],
             states={
                 PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_admin_password)],
-                MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_menu)],
+                MENU: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, admin_menu),
+                    CallbackQueryHandler(admin_users_page, pattern=r"^users:\d+$"),
+                    CallbackQueryHandler(admin_history_page, pattern=r"^history:\d+:\d+$"),
+                ],
                 VIEW_HISTORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, view_user_history)],
                 DELETE_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_user)],
             },
             fallbacks=[CommandHandler("cancel", cancel_admin)],
+            name="admin",
+            persistent=True,
         )
 
         # Add handlers
@@ -454,8 +747,11 @@ def main():
         app.add_handler(CommandHandler("clear", clear))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 
-        # Determine run mode (polling or webhook)
-        if os.environ.get("USE_WEBHOOK", "false").lower() == "true":
+        # Determine run mode (cluster worker, polling or webhook)
+        if WORKER_PORT:
+            logger.info(f"Bot running as cluster worker {os.environ.get('WORKER_INDEX', 0)}")
+            asyncio.run(serve_worker(app, WORKER_PORT))
+        elif os.environ.get("USE_WEBHOOK", "false").lower() == "true":
             port = int(os.environ.get("PORT", 8443))
             app.run_webhook(
                 listen="0.0.0.0",
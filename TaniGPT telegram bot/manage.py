@@ -0,0 +1,158 @@
+import os
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from cluster import run_cluster, CLUSTER_WORKERS
+from storage import ArchiveStorage, JsonStorage, SqliteStorage, get_storage, STORAGE_BACKEND, USER_DATA_DIR, USER_INDEX_FILE, SQLITE_PATH
+
+# Setup logging
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Copy user_index.json + user_data/ into the SQLite backend, keeping user numbers
+def migrate(args):
+    source = JsonStorage(args.data_dir, args.index_file)
+    target = SqliteStorage(args.sqlite_path)
+    migrated = 0
+    for telegram_id, user_number in source.list_users():
+        user_data = source.load_user_file(user_number)
+        if user_data is None:
+            logger.warning(f"Skipping user {user_number}: user file is missing")
+            continue
+        target.import_user(
+            telegram_id,
+            user_number,
+            user_data['name'],
+            user_data['phone_number'],
+            user_data.get('chat_history', [])
+        )
+        migrated += 1
+    target.close()
+    logger.info(f"Migrated {migrated} users from {args.index_file} to {args.sqlite_path}")
+
+
+# Rebuild the phone number -> user number index from the user store
+def rebuild_phone_index(args):
+    storage = get_storage(args.backend)
+    duplicates = storage.rebuild_phone_index()
+    storage.close()
+    for phone_number, kept, duplicate in duplicates:
+        logger.warning(f"Phone {phone_number} is used by users {kept} and {duplicate}; index keeps user {kept}")
+    logger.info(f"Phone index rebuilt ({len(duplicates)} duplicates)")
+
+
+# Move user_N.json chat histories into the compressed history archive (STORAGE_BACKEND=archive).
+# Rolling rewrites each hot log, which would lose appends from a running bot, so the bot and the
+# admin panel must be stopped first (checked on Linux/macOS, up to you on Windows).
+def compact_history(args):
+    storage = ArchiveStorage(args.data_dir, args.index_file)
+    if not storage.archive.lock(exclusive=True):
+        raise RuntimeError("The history archive is in use; stop the bot and the admin panel before compact-history")
+    before = after = rolled = 0
+    for _, user_number in storage.list_users():
+        user_file = storage.user_file(user_number)
+        if not os.path.exists(user_file):
+            logger.warning(f"Skipping user {user_number}: user file is missing")
+            continue
+        before += os.path.getsize(user_file) + storage.archive.disk_usage(user_number)
+        rolled += storage.compact(user_number)
+        after += os.path.getsize(user_file) + storage.archive.disk_usage(user_number)
+    logger.info(
+        f"Compacted history for {len(storage.list_users())} users: {before / 1024:.1f} KiB -> "
+        f"{after / 1024:.1f} KiB, {rolled} messages moved to cold segments"
+    )
+    storage.close()
+
+
+# Stream every user and message into columnar users/messages files (needs pyarrow)
+def export_data(args):
+    from analytics import export_store
+    storage = get_storage(args.backend)
+    users, messages = export_store(storage, args.output, args.format, args.batch_rows)
+    storage.close()
+    logger.info(f"Exported {users} users and {messages} messages to {args.output}")
+
+
+# Aggregate report over an export directory (needs pyarrow, pandas and numpy)
+def report(args):
+    from analytics import build_report
+    result = build_report(args.input, args.batch_rows)
+    daily = result.pop('daily_active_users')
+    source = result.pop('daily_active_source')
+    for key, value in result.items():
+        print(f"{key:<20}{value:>14.2f}" if isinstance(value, float) else f"{key:<20}{value:>14}")
+    print(f"\nActive users per day ({'from message times' if source == 'messages' else 'by last activity'}):")
+    for day, count in daily.items():
+        print(f"{day:<20}{count:>14}")
+
+
+# Restore users and their histories from an export directory into the chosen backend
+def import_data(args):
+    from analytics import import_store
+    storage = get_storage(args.backend)
+    imported = import_store(storage, args.input, args.batch_rows)
+    storage.close()
+    logger.info(f"Imported {imported} users from {args.input}")
+
+
+# Webhook ingress plus N supervised bot workers, sharded by Telegram user id
+def cluster(args):
+    load_dotenv()
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError("Missing TELEGRAM_BOT_TOKEN in .env. Set it in your .env file or environment variables.")
+    run_cluster(token, os.environ.get("DOMAIN"), args.port, args.workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TaniGPT maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Migrate JSON user files into SQLite")
+    migrate_parser.add_argument("--data-dir", default=USER_DATA_DIR)
+    migrate_parser.add_argument("--index-file", default=USER_INDEX_FILE)
+    migrate_parser.add_argument("--sqlite-path", default=SQLITE_PATH)
+    migrate_parser.set_defaults(func=migrate)
+
+    phone_parser = subparsers.add_parser("rebuild-phone-index", help="Rebuild the phone uniqueness index")
+    phone_parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["json", "archive", "sqlite"])
+    phone_parser.set_defaults(func=rebuild_phone_index)
+
+    compact_parser = subparsers.add_parser(
+        "compact-history", help="Move chat histories into the compressed archive (stop the bot first)")
+    compact_parser.add_argument("--data-dir", default=USER_DATA_DIR)
+    compact_parser.add_argument("--index-file", default=USER_INDEX_FILE)
+    compact_parser.set_defaults(func=compact_history)
+
+    export_parser = subparsers.add_parser("export", help="Export users and chat history to Parquet or Arrow")
+    export_parser.add_argument("--output", default="export")
+    export_parser.add_argument("--format", default="parquet", choices=["parquet", "arrow"])
+    export_parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["json", "archive", "sqlite"])
+    export_parser.add_argument("--batch-rows", type=int, default=int(os.environ.get("EXPORT_BATCH_ROWS", 20000)))
+    export_parser.set_defaults(func=export_data)
+
+    report_parser = subparsers.add_parser("report", help="Usage report over an export")
+    report_parser.add_argument("--input", default="export")
+    report_parser.add_argument("--batch-rows", type=int, default=int(os.environ.get("EXPORT_BATCH_ROWS", 20000)))
+    report_parser.set_defaults(func=report)
+
+    import_parser = subparsers.add_parser("import", help="Bulk restore users and chat history from an export")
+    import_parser.add_argument("--input", default="export")
+    import_parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["json", "archive", "sqlite"])
+    import_parser.add_argument("--batch-rows", type=int, default=int(os.environ.get("EXPORT_BATCH_ROWS", 20000)))
+    import_parser.set_defaults(func=import_data)
+
+    cluster_parser = subparsers.add_parser("cluster", help="Run the webhook ingress and a pool of bot workers")
+    cluster_parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS)
+    cluster_parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8443)))
+    cluster_parser.set_defaults(func=cluster)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import os
+import sys
+import math
+import time
+import logging
+import threading
+import functools
+from collections import Counter as FrameCounter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Metrics settings (METRICS_PORT=0 disables the HTTP endpoint)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+STORAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in items
+        ]
+
+
+class Gauge(Metric):
+    """A gauge whose value is read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.error(f"Gauge {self.name} failed: {str(e)}")
+            return []
+        return self.header() + [f"{self.name} {value}"]
+
+
+class CallbackCounter(Gauge):
+    """A counter whose total is kept elsewhere and read from a callback at scrape time."""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.values.items()]
+        lines = self.header()
+        for labels, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, ('le', bound))} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def counter(self, name, documentation, callback):
+        return self.register(CallbackCounter(name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+llm_latency = registry.register(Histogram(
+    "tanigpt_llm_latency_seconds", "Mistral request latency", ["mode"]))
+llm_first_token = registry.register(Histogram(
+    "tanigpt_llm_first_token_seconds", "Time to first streamed token"))
+llm_errors = registry.register(Counter(
+    "tanigpt_llm_errors_total", "Failed Mistral requests", ["reason"]))
+storage_latency = registry.register(Histogram(
+    "tanigpt_storage_seconds", "Storage backend call latency", ["operation"], STORAGE_BUCKETS))
+handler_latency = registry.register(Histogram(
+    "tanigpt_handler_seconds", "Telegram handler end-to-end latency", ["handler"]))
+intent_hits = registry.register(Counter(
+    "tanigpt_intent_hits_total", "Messages answered by a local intent", ["intent"]))
+superseded_generations = registry.register(Counter(
+    "tanigpt_superseded_generations_total", "LLM calls cancelled because the user sent more input"))
+llm_hedges = registry.register(Counter(
+    "tanigpt_llm_hedged_requests_total", "Duplicate Mistral requests sent after the p95 latency"))
+llm_fallbacks = registry.register(Counter(
+    "tanigpt_llm_fallbacks_total", "Requests served by the fallback model"))
+
+
+# Handler decorator recording end-to-end latency under the handler's name
+def timed_handler(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with handler_latency.time(func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+# Wrap the Storage interface methods so every call lands in tanigpt_storage_seconds
+def instrument_storage(storage):
+    for name, attr in vars(Storage).items():
+        if name.startswith("_") or name == "close" or not callable(attr):
+            continue
+        setattr(storage, name, time_call(storage_latency, name, getattr(storage, name)))
+    return storage
+
+
+def time_call(histogram, label, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with histogram.time(label):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval and returns folded stacks for flamegraphs."""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def collect(self, thread_id, seconds):
+        stacks = FrameCounter()
+        deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        # One capture at a time; sampling is only active while someone asked for it
+        with self.lock:
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(self.interval)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+profiler = SamplingProfiler()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Thread running the bot's event loop, set by start_http_server
+    target_thread_id = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.respond(200, registry.render(), "text/plain; version=0.0.4")
+        elif url.path == "/ping":
+            self.respond(200, "I'm alive!", "text/plain")
+        elif url.path == "/debug/profile":
+            try:
+                seconds = float(parse_qs(url.query).get("seconds", ["10"])[0])
+            except ValueError:
+                seconds = math.nan
+            if not 0 < seconds < math.inf:
+                self.respond(400, "seconds must be a positive number", "text/plain")
+                return
+            self.respond(200, profiler.collect(self.target_thread_id, seconds), "text/plain")
+        else:
+            self.respond(404, "Not found", "text/plain")
+
+    def respond(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Metrics are optional, so a port that is taken (another instance, a leftover process) is logged
+# and the bot starts without the endpoint
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    if port <= 0:
+        return None
+    MetricsHandler.target_thread_id = threading.get_ident()
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"Metrics endpoint disabled, cannot listen on {host}:{port}: {str(e)}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
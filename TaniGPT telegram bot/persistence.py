@@ -0,0 +1,162 @@
+import os
+import json
+import asyncio
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Conversation state settings (PERSISTENCE_FILE="" keeps state in memory only)
+PERSISTENCE_FILE = os.environ.get("PERSISTENCE_FILE", "bot_state.json")
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", 10))
+WARM_START_SESSIONS = int(os.environ.get("WARM_START_SESSIONS", 200))
+
+
+class JsonPersistence(BasePersistence):
+    """ConversationHandler states and user_data in one JSON file.
+
+    The Application hands over changes every PERSISTENCE_INTERVAL seconds; each batch
+    becomes a single atomic file write. The file also remembers which users had a
+    session in memory, so a restarted bot can load those before they come back.
+    user_data values must be JSON serializable.
+    """
+
+    def __init__(self, path=PERSISTENCE_FILE, update_interval=PERSISTENCE_INTERVAL, hot_sessions=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        # Callback returning the Telegram ids to warm up on the next start
+        self.hot_sessions = hot_sessions
+        self.user_data = None
+        self.conversations = None
+        self.warm_sessions = []
+        self.write_pending = False
+        self.write_task = None
+
+    def load(self):
+        if self.conversations is not None:
+            return
+        data = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+            except ValueError as e:
+                logger.error(f"Ignoring unreadable state file {self.path}: {str(e)}")
+        self.user_data = {int(user_id): values for user_id, values in data.get('user_data', {}).items()}
+        self.conversations = {
+            name: {tuple(key): state for key, state in entries}
+            for name, entries in data.get('conversations', {}).items()
+        }
+        self.warm_sessions = data.get('hot_sessions', [])
+        logger.info(f"Loaded conversation state for {len(self.user_data)} users from {self.path}")
+
+    def snapshot(self):
+        return {
+            'conversations': {
+                name: [[list(key), state] for key, state in states.items()]
+                for name, states in self.conversations.items()
+            },
+            'user_data': {str(user_id): values for user_id, values in self.user_data.items()},
+            'hot_sessions': self.hot_sessions() if self.hot_sessions else self.warm_sessions
+        }
+
+    async def write(self):
+        await asyncio.to_thread(write_json_atomic, self.path, self.snapshot())
+
+    async def write_soon(self):
+        # Let the rest of this update_persistence batch land first, then write once
+        await asyncio.sleep(0)
+        try:
+            while self.write_pending:
+                self.write_pending = False
+                await self.write()
+        except Exception as e:
+            logger.error(f"Failed to write conversation state to {self.path}: {str(e)}")
+        finally:
+            self.write_task = None
+
+    def mark_dirty(self):
+        self.write_pending = True
+        if self.path and self.write_task is None:
+            self.write_task = asyncio.create_task(self.write_soon())
+
+    async def get_user_data(self):
+        self.load()
+        return {user_id: dict(values) for user_id, values in self.user_data.items()}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        self.load()
+        return dict(self.conversations.get(name, {}))
+
+    async def update_conversation(self, name, key, new_state):
+        self.load()
+        states = self.conversations.setdefault(name, {})
+        if new_state is None:
+            if states.pop(key, None) is None:
+                return
+        elif states.get(key) == new_state:
+            return
+        else:
+            states[key] = new_state
+        self.mark_dirty()
+
+    async def update_user_data(self, user_id, data):
+        self.load()
+        if not data:
+            # Nothing worth keeping for this user
+            await self.drop_user_data(user_id)
+            return
+        if self.user_data.get(user_id) == data:
+            return
+        self.user_data[user_id] = dict(data)
+        self.mark_dirty()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self.load()
+        if self.user_data.pop(user_id, None) is not None:
+            self.mark_dirty()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self.write_task is not None:
+            await self.write_task
+        if not self.path or self.conversations is None:
+            return
+        # Always written on shutdown so the warm-start list is current
+        await self.write()
+        logger.info(f"Saved conversation state to {self.path}")
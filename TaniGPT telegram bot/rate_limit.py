@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Admission control settings
+RATE_LIMIT_USER_RATE = float(os.environ.get("RATE_LIMIT_USER_RATE", 0.5))
+RATE_LIMIT_USER_BURST = int(os.environ.get("RATE_LIMIT_USER_BURST", 5))
+RATE_LIMIT_GLOBAL_RATE = float(os.environ.get("RATE_LIMIT_GLOBAL_RATE", 10))
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", 20))
+RATE_LIMIT_BACKOFF = float(os.environ.get("RATE_LIMIT_BACKOFF", 2))
+RATE_LIMIT_MAX_BACKOFF = float(os.environ.get("RATE_LIMIT_MAX_BACKOFF", 30))
+RATE_LIMIT_TRACKED_USERS = int(os.environ.get("RATE_LIMIT_TRACKED_USERS", 10000))
+
+
+class QueueTimeout(asyncio.TimeoutError):
+    """Timed out waiting for an LLM slot, before any request reached the provider."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        self.refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class UserRateLimiter:
+    """One token bucket per Telegram user, oldest idle users forgotten first."""
+
+    def __init__(self, rate=RATE_LIMIT_USER_RATE, burst=RATE_LIMIT_USER_BURST,
+                 max_users=RATE_LIMIT_TRACKED_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        # Users already told to slow down since their bucket ran dry
+        self.notified = set()
+
+    def allow(self, user_id):
+        if self.rate <= 0:
+            return True
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            while len(self.buckets) > self.max_users:
+                stale_user, _ = self.buckets.popitem(last=False)
+                self.notified.discard(stale_user)
+        self.buckets.move_to_end(user_id)
+        if bucket.try_acquire():
+            self.notified.discard(user_id)
+            return True
+        return False
+
+    def should_notify(self, user_id):
+        if user_id in self.notified:
+            return False
+        self.notified.add(user_id)
+        return True
+
+
+def retry_after(error):
+    raw_response = getattr(error, "raw_response", None)
+    if raw_response is None:
+        return None
+    try:
+        return float(raw_response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429
+
+
+class FairScheduler:
+    """Bounded LLM concurrency, handed out round-robin across users and paced by a global bucket."""
+
+    def __init__(self, max_concurrency, rate=RATE_LIMIT_GLOBAL_RATE, burst=RATE_LIMIT_GLOBAL_BURST,
+                 backoff=RATE_LIMIT_BACKOFF, max_backoff=RATE_LIMIT_MAX_BACKOFF):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self.active = 0
+        self.queues = OrderedDict()
+        self.timer = None
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def schedule_dispatch(self, delay):
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(delay, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.dispatch()
+
+    def next_waiter(self):
+        while self.queues:
+            user_key, queue = next(iter(self.queues.items()))
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                del self.queues[user_key]
+                continue
+            return user_key, queue
+        return None, None
+
+    def dispatch(self):
+        while self.active < self.max_concurrency:
+            user_key, queue = self.next_waiter()
+            if queue is None:
+                return
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                self.schedule_dispatch(pause)
+                return
+            if self.bucket is not None and not self.bucket.try_acquire():
+                self.schedule_dispatch(self.bucket.wait_time())
+                return
+            waiter = queue.popleft()
+            # Served users go to the back of the line
+            if queue:
+                self.queues.move_to_end(user_key)
+            else:
+                del self.queues[user_key]
+            self.active += 1
+            waiter.set_result(None)
+
+    async def acquire(self, user_key):
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_key, deque()).append(waiter)
+        self.dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_key, timeout=None):
+        try:
+            await asyncio.wait_for(self.acquire(user_key), timeout)
+        except asyncio.TimeoutError:
+            raise QueueTimeout(f"No LLM slot within {timeout} seconds") from None
+        try:
+            yield
+        finally:
+            self.release()
+
+    # Called on a provider 429: pause all dispatch, doubling the pause while it keeps happening
+    def throttled(self, delay=None):
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else self.initial_backoff)
+        pause = max(delay or 0, self.backoff)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        logger.warning(f"LLM provider rate limited us, pausing requests for {pause:.1f} seconds")
+
+    def recovered(self):
+        self.backoff = 0.0
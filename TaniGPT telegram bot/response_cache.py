@@ -0,0 +1,124 @@
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+
+# Response cache settings (opt-in)
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+# Jaccard similarity of word sets needed for a near-duplicate hit, 0 disables the tier
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", 0))
+
+NON_WORD = re.compile(r"[^\w\s]+")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    text = NON_WORD.sub(" ", text.lower())
+    return WHITESPACE.sub(" ", text).strip()
+
+
+# The reply depends on everything sent with the prompt (system prompt, summary, earlier turns),
+# so all of it is part of the key: a reply is never shared between different conversations
+def context_fingerprint(context):
+    digest = hashlib.sha1()
+    for message in context:
+        digest.update(f"{message['role']}\0{message['content']}\0".encode())
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, words, response, expires_at):
+        self.words = words
+        self.response = response
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """TTL + LRU cache of LLM replies keyed on normalized prompt and conversation context."""
+
+    def __init__(self, enabled=RESPONSE_CACHE, max_entries=RESPONSE_CACHE_SIZE,
+                 ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()
+        # context fingerprint -> keys, so the similarity tier only scans comparable entries
+        self.buckets = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        bucket = self.buckets.get(key[0])
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[key[0]]
+
+    def lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < now:
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def find_similar(self, fingerprint, words, now):
+        best_key, best_score = None, 0.0
+        for key in list(self.buckets.get(fingerprint, ())):
+            entry = self.lookup(key, now)
+            if entry is None or not entry.words:
+                continue
+            score = len(words & entry.words) / len(words | entry.words)
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is not None and best_score >= self.similarity:
+            return self.entries[best_key]
+        return None
+
+    def get(self, prompt, context):
+        if not self.enabled:
+            return None
+        now = time.time()
+        normalized = normalize_prompt(prompt)
+        fingerprint = context_fingerprint(context)
+        entry = self.lookup((fingerprint, normalized), now)
+        if entry is not None:
+            self.hits += 1
+            return entry.response
+        if self.similarity > 0 and normalized:
+            entry = self.find_similar(fingerprint, set(normalized.split()), now)
+            if entry is not None:
+                self.similar_hits += 1
+                return entry.response
+        self.misses += 1
+        return None
+
+    def put(self, prompt, context, response):
+        if not self.enabled:
+            return
+        normalized = normalize_prompt(prompt)
+        key = (context_fingerprint(context), normalized)
+        self.remove(key)
+        self.entries[key] = CacheEntry(set(normalized.split()), response, time.time() + self.ttl)
+        self.buckets.setdefault(key[0], set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def stats(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.similar_hits) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,200 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Session cache settings
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 1000))
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", 5))
+
+
+class Session:
+    """One active user: profile, trimmed history and messages not yet written to storage."""
+
+    def __init__(self, telegram_id, user_number, profile, history):
+        self.telegram_id = telegram_id
+        self.user_number = user_number
+        self.profile = profile
+        self.history = history
+        self.summary = None
+        self.pending = []
+        # Incoming user messages waiting for the next turn
+        self.inbox = []
+        # Bumped per incoming message, so a debounced handler can tell a newer one arrived
+        self.inbox_seq = 0
+        # LLM call of the running turn, cancelled when newer input supersedes it
+        self.generation = None
+        self.superseded = False
+        self.lock = asyncio.Lock()
+        self.flush_lock = asyncio.Lock()
+
+    @property
+    def name(self):
+        return self.profile['name']
+
+    @property
+    def dirty(self):
+        return bool(self.pending)
+
+    # A handler holds or is about to use this session: mid-turn, debouncing, or generating
+    @property
+    def busy(self):
+        return (self.lock.locked() or bool(self.inbox)
+                or (self.generation is not None and not self.generation.done()))
+
+
+class SessionCache:
+    """LRU of Sessions keyed by Telegram user id, flushed to storage in the background."""
+
+    def __init__(self, storage, max_sessions=SESSION_CACHE_SIZE, history_limit=10,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.storage = storage
+        self.max_sessions = max_sessions
+        self.history_limit = history_limit
+        self.flush_interval = flush_interval
+        self.sessions = OrderedDict()
+        self.flush_task = None
+
+    async def get(self, telegram_id):
+        telegram_id = str(telegram_id)
+        session = self.sessions.get(telegram_id)
+        if session is not None:
+            self.sessions.move_to_end(telegram_id)
+            return session
+
+        user_number = await asyncio.to_thread(self.storage.get_user_number, telegram_id)
+        if not user_number:
+            return None
+        profile = await asyncio.to_thread(self.storage.get_user, user_number)
+        if profile is None:
+            return None
+        history = await asyncio.to_thread(self.storage.get_history, user_number, self.history_limit)
+
+        # Another task may have loaded the same user while we were waiting on storage
+        session = self.sessions.get(telegram_id)
+        if session is None:
+            session = Session(telegram_id, user_number, profile, history)
+            self.sessions[telegram_id] = session
+            await self.evict(keep=telegram_id)
+        self.sessions.move_to_end(telegram_id)
+        return session
+
+    # Drop least recently used sessions over the limit. Busy sessions stay, so a handler never
+    # works on a detached copy, and so does any session whose flush fails: its pending messages
+    # are retried by the flush loop instead of being lost, and the caller's request goes on.
+    async def evict(self, keep=None):
+        for telegram_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            session = self.sessions.get(telegram_id)
+            if session is None or telegram_id == keep or session.busy:
+                continue
+            if session.dirty:
+                try:
+                    await self.flush_session(session)
+                except Exception as e:
+                    logger.error(f"Keeping session for user {session.user_number} cached: {str(e)}")
+                    continue
+            # The flush gave other handlers a chance to pick the session up again
+            if session.busy or session.dirty or self.sessions.get(telegram_id) is not session:
+                continue
+            del self.sessions[telegram_id]
+
+    async def append(self, session, messages):
+        session.history.extend(messages)
+        del session.history[:-self.history_limit]
+        session.pending.extend(messages)
+        if self.flush_interval <= 0:
+            await self.flush_session(session)
+
+    async def reset(self, session, history):
+        async with session.flush_lock:
+            session.pending = []
+            session.history = list(history)
+            session.summary = None
+            await asyncio.to_thread(self.storage.reset_history, session.user_number, history)
+
+    # Telegram ids of the most recently used sessions, least recent first
+    def hot_ids(self, limit):
+        return list(self.sessions)[-limit:] if limit > 0 else []
+
+    # Load sessions ahead of their users' next message, one at a time to keep startup light
+    async def preload(self, telegram_ids):
+        loaded = 0
+        for telegram_id in telegram_ids:
+            if len(self.sessions) >= self.max_sessions:
+                break
+            try:
+                if await self.get(telegram_id) is not None:
+                    loaded += 1
+            except Exception as e:
+                logger.error(f"Failed to preload session for {telegram_id}: {str(e)}")
+        logger.info(f"Preloaded {loaded} sessions")
+
+    def invalidate(self, user_number):
+        for telegram_id, session in list(self.sessions.items()):
+            if session.user_number == str(user_number):
+                del self.sessions[telegram_id]
+
+    # Delete a user from storage between their turns: the running turn and flush finish first,
+    # and what they leave unflushed is dropped, so nothing is written back for a deleted user
+    async def delete_user(self, user_number):
+        user_number = str(user_number)
+        session = next((s for s in self.sessions.values() if s.user_number == user_number), None)
+        if session is None:
+            return await asyncio.to_thread(self.storage.delete_user, user_number)
+        async with session.lock, session.flush_lock:
+            self.invalidate(user_number)
+            session.pending = []
+            return await asyncio.to_thread(self.storage.delete_user, user_number)
+
+    async def flush_session(self, session):
+        async with session.flush_lock:
+            messages, session.pending = session.pending, []
+            if not messages:
+                return
+            try:
+                await asyncio.to_thread(self.storage.append_messages, session.user_number, messages)
+            except Exception as e:
+                session.pending = messages + session.pending
+                if await self.user_deleted(session.user_number):
+                    # Deleted from outside this process (web admin, another cluster worker)
+                    logger.warning(f"User {session.user_number} no longer exists, dropping their session")
+                    session.pending = []
+                    self.invalidate(session.user_number)
+                    return
+                logger.error(f"Failed to flush session for user {session.user_number}: {str(e)}")
+                raise
+
+    async def user_deleted(self, user_number):
+        try:
+            return await asyncio.to_thread(self.storage.get_user, user_number) is None
+        except Exception:
+            return False
+
+    async def flush(self):
+        dirty = [session for session in self.sessions.values() if session.dirty]
+        for session in dirty:
+            await self.flush_session(session)
+        if dirty:
+            logger.info(f"Flushed {len(dirty)} dirty sessions")
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Session flush failed: {str(e)}")
+
+    def start(self):
+        if self.flush_interval > 0 and self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
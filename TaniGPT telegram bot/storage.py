@@ -0,0 +1,679 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from history_archive import HistoryArchive
+
+logger = logging.getLogger(__name__)
+
+# Storage settings
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json").lower()
+USER_DATA_DIR = os.environ.get("USER_DATA_DIR", "user_data")
+USER_INDEX_FILE = os.environ.get("USER_INDEX_FILE", "user_index.json")
+PHONE_INDEX_FILE = os.environ.get("PHONE_INDEX_FILE", "phone_index.json")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "tanigpt.db")
+
+
+class PhoneNumberTaken(Exception):
+    pass
+
+
+class Storage:
+    """Interface shared by the storage backends. User numbers are strings."""
+
+    def get_user_number(self, telegram_id):
+        raise NotImplementedError
+
+    def get_user(self, user_number):
+        raise NotImplementedError
+
+    def list_users(self):
+        raise NotImplementedError
+
+    # Profiles only (user_number, telegram_id, name, phone_number), ordered by user number.
+    # `query` keeps profiles whose name, phone number or Telegram ID contains it, or whose
+    # user number equals it.
+    def list_profiles(self, offset=0, limit=None, query=None):
+        raise NotImplementedError
+
+    def count_users(self, query=None):
+        raise NotImplementedError
+
+    def phone_exists(self, phone_number):
+        raise NotImplementedError
+
+    def create_user(self, telegram_id, name, phone_number, history):
+        raise NotImplementedError
+
+    def delete_user(self, user_number):
+        raise NotImplementedError
+
+    # Up to `limit` messages ending `skip_recent` messages before the newest, oldest first
+    def get_history(self, user_number, limit=None, skip_recent=0):
+        raise NotImplementedError
+
+    def append_messages(self, user_number, messages):
+        raise NotImplementedError
+
+    def reset_history(self, user_number, history):
+        raise NotImplementedError
+
+    def import_user(self, telegram_id, user_number, name, phone_number, history):
+        raise NotImplementedError
+
+    # Bulk restore from an iterable of import_user argument tuples; returns the number imported
+    def import_users(self, users):
+        imported = 0
+        for telegram_id, user_number, name, phone_number, history in users:
+            self.import_user(telegram_id, user_number, name, phone_number, history)
+            imported += 1
+        return imported
+
+    # Whole history, each message with a created_at timestamp (None if the backend keeps none)
+    def export_history(self, user_number):
+        return [dict(message, created_at=None) for message in self.get_history(user_number)]
+
+    # Unix time of the user's last write, when the backend can tell without per-message times
+    def last_active(self, user_number):
+        return None
+
+    def rebuild_phone_index(self):
+        raise NotImplementedError
+
+    # Opaque token that changes whenever the users, or the given user's history, change
+    def data_version(self, user_number=None):
+        raise NotImplementedError
+
+    # Pick up writes made by another process (the bot, when read from the web admin)
+    def refresh(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def profile_matches(profile, query):
+    query = query.lower()
+    return (
+        profile['user_number'] == query
+        or query in profile['name'].lower()
+        or query in profile['phone_number']
+        or query in profile['telegram_id']
+    )
+
+
+def file_version(path):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class JsonStorage(Storage):
+    """Original layout: user_index.json plus one user_data/user_N.json per user.
+
+    phone_index.json maps phone numbers to user numbers and holds the next free
+    user number, so signup never has to open every user file. user_index.json
+    entries also carry the name and phone number, so profile lookups and admin
+    listings never open a user file either.
+    """
+
+    def __init__(self, data_dir=USER_DATA_DIR, index_file=USER_INDEX_FILE, phone_index_file=PHONE_INDEX_FILE):
+        self.data_dir = data_dir
+        self.index_file = index_file
+        self.phone_index_file = phone_index_file
+        self.lock = threading.RLock()
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.load_indexes()
+
+    def load_indexes(self):
+        with self.lock:
+            self.user_index = {}
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r') as f:
+                    self.user_index = json.load(f)
+            # user_number -> profile, and the user numbers in order for paging
+            self.profiles = {}
+            self.profile_order = None
+            self.load_profiles()
+            self.phone_index = {}
+            self.next_user_number = 1
+            if os.path.exists(self.phone_index_file):
+                with open(self.phone_index_file, 'r') as f:
+                    data = json.load(f)
+                self.phone_index = data['phones']
+                self.next_user_number = data['next_user_number']
+            else:
+                self.rebuild_phone_index()
+            self.index_version = file_version(self.index_file)
+
+    def user_file(self, user_number):
+        return os.path.join(self.data_dir, f"user_{user_number}.json")
+
+    def load_user_file(self, user_number):
+        user_file = self.user_file(user_number)
+        if not os.path.exists(user_file):
+            return None
+        with open(user_file, 'r') as f:
+            return json.load(f)
+
+    def load_profiles(self):
+        backfilled = 0
+        for uid, data in self.user_index.items():
+            if 'name' not in data:
+                # Index written before profiles were kept in it
+                user_data = self.load_user_file(data['user_number'])
+                if user_data is None:
+                    continue
+                data['name'] = user_data['name']
+                data['phone_number'] = user_data['phone_number']
+                backfilled += 1
+            self.profiles[data['user_number']] = {
+                'user_number': data['user_number'],
+                'telegram_id': uid,
+                'name': data['name'],
+                'phone_number': data['phone_number']
+            }
+        if backfilled:
+            self.save_index()
+            logger.info(f"Added profiles for {backfilled} users to {self.index_file}")
+
+    def save_index(self):
+        write_json_atomic(self.index_file, self.user_index)
+        self.index_version = file_version(self.index_file)
+
+    def save_phone_index(self):
+        write_json_atomic(self.phone_index_file, {
+            'next_user_number': self.next_user_number,
+            'phones': self.phone_index
+        })
+
+    def get_user_number(self, telegram_id):
+        data = self.user_index.get(str(telegram_id))
+        return data['user_number'] if data else None
+
+    def get_user(self, user_number):
+        profile = self.profiles.get(str(user_number))
+        if profile is None:
+            return None
+        return {'name': profile['name'], 'phone_number': profile['phone_number']}
+
+    def list_users(self):
+        return [(uid, data['user_number']) for uid, data in self.user_index.items()]
+
+    def list_profiles(self, offset=0, limit=None, query=None):
+        with self.lock:
+            if self.profile_order is None:
+                self.profile_order = sorted(self.profiles, key=int)
+            order = self.profile_order
+            if query:
+                order = [number for number in order if profile_matches(self.profiles[number], query)]
+            page = order[offset:offset + limit if limit else None]
+            return [dict(self.profiles[user_number]) for user_number in page]
+
+    def count_users(self, query=None):
+        with self.lock:
+            if query:
+                return sum(1 for profile in self.profiles.values() if profile_matches(profile, query))
+            return len(self.profiles)
+
+    def phone_exists(self, phone_number):
+        return phone_number in self.phone_index
+
+    def create_user(self, telegram_id, name, phone_number, history):
+        with self.lock:
+            if phone_number in self.phone_index:
+                raise PhoneNumberTaken(phone_number)
+            user_number = str(self.next_user_number)
+            self.import_user(telegram_id, user_number, name, phone_number, history)
+        return user_number
+
+    def delete_user(self, user_number):
+        with self.lock:
+            user_file = self.user_file(user_number)
+            if not os.path.exists(user_file):
+                return False
+            for uid, data in list(self.user_index.items()):
+                if data['user_number'] == user_number:
+                    del self.user_index[uid]
+                    self.save_index()
+                    break
+            self.profiles.pop(user_number, None)
+            self.profile_order = None
+            phone_number = self.load_user_file(user_number)['phone_number']
+            if self.phone_index.get(phone_number) == user_number:
+                del self.phone_index[phone_number]
+                self.save_phone_index()
+            os.remove(user_file)
+        return True
+
+    def get_history(self, user_number, limit=None, skip_recent=0):
+        with self.lock:
+            user_data = self.load_user_file(user_number)
+        history = user_data.get('chat_history', []) if user_data else []
+        end = len(history) - skip_recent
+        if end <= 0:
+            return []
+        return history[max(0, end - limit) if limit else 0:end]
+
+    def append_messages(self, user_number, messages):
+        with self.lock:
+            user_data = self.load_user_file(user_number)
+            user_data['chat_history'].extend(messages)
+            write_json_atomic(self.user_file(user_number), user_data)
+
+    def reset_history(self, user_number, history):
+        with self.lock:
+            user_data = self.load_user_file(user_number)
+            user_data['chat_history'] = list(history)
+            write_json_atomic(self.user_file(user_number), user_data)
+
+    def write_user(self, user_number, name, phone_number, history):
+        user_data = {
+            'name': name,
+            'phone_number': phone_number,
+            'chat_history': list(history)
+        }
+        write_json_atomic(self.user_file(user_number), user_data)
+
+    def import_user(self, telegram_id, user_number, name, phone_number, history):
+        with self.lock:
+            self.add_user(telegram_id, user_number, name, phone_number, history)
+            self.save_index()
+            self.save_phone_index()
+
+    # User files are written as they come, the two indexes only once at the end
+    def import_users(self, users):
+        imported = 0
+        with self.lock:
+            try:
+                for telegram_id, user_number, name, phone_number, history in users:
+                    self.add_user(telegram_id, user_number, name, phone_number, history)
+                    imported += 1
+            finally:
+                self.save_index()
+                self.save_phone_index()
+        return imported
+
+    def add_user(self, telegram_id, user_number, name, phone_number, history):
+        with self.lock:
+            self.write_user(user_number, name, phone_number, history)
+            previous = self.user_index.get(str(telegram_id))
+            if previous is not None:
+                self.profiles.pop(previous['user_number'], None)
+            profile = {'user_number': str(user_number), 'name': name, 'phone_number': phone_number}
+            self.user_index[str(telegram_id)] = profile
+            self.profiles[str(user_number)] = dict(profile, telegram_id=str(telegram_id))
+            self.profile_order = None
+            self.phone_index[phone_number] = str(user_number)
+            self.next_user_number = max(self.next_user_number, int(user_number) + 1)
+
+    def rebuild_phone_index(self):
+        with self.lock:
+            phone_index = {}
+            duplicates = []
+            highest = 0
+            for uid, data in self.user_index.items():
+                user_number = data['user_number']
+                highest = max(highest, int(user_number))
+                user_data = self.load_user_file(user_number)
+                if user_data is None:
+                    continue
+                phone_number = user_data['phone_number']
+                if phone_number in phone_index:
+                    duplicates.append((phone_number, phone_index[phone_number], user_number))
+                    continue
+                phone_index[phone_number] = user_number
+            self.phone_index = phone_index
+            self.next_user_number = max(self.next_user_number, highest + 1)
+            self.save_phone_index()
+        logger.info(f"Rebuilt phone index with {len(phone_index)} numbers")
+        return duplicates
+
+    def data_version(self, user_number=None):
+        version = f"{file_version(self.index_file)}"
+        if user_number is not None:
+            version += f"-{file_version(self.user_file(user_number))}"
+        return version
+
+    # Every history write replaces the user file
+    def last_active(self, user_number):
+        user_file = self.user_file(user_number)
+        return os.path.getmtime(user_file) if os.path.exists(user_file) else None
+
+    def refresh(self):
+        # Every write replaces user_index.json, so its mtime tells us when to reload
+        if file_version(self.index_file) != self.index_version:
+            self.load_indexes()
+
+
+class ArchiveStorage(JsonStorage):
+    """JSON layout with chat history moved into a HistoryArchive under user_data/history/.
+
+    user_N.json keeps only the profile. A file that still has its chat_history is
+    moved into the archive the first time that user is touched, or all at once by
+    `python manage.py compact-history`.
+    """
+
+    def __init__(self, data_dir=USER_DATA_DIR, index_file=USER_INDEX_FILE, phone_index_file=PHONE_INDEX_FILE):
+        self.archive = HistoryArchive(os.path.join(data_dir, "history"))
+        if not self.archive.lock():
+            raise RuntimeError("The history archive is being compacted; wait for compact-history to finish")
+        # Users whose user file is known to hold no chat_history
+        self.converted = set()
+        super().__init__(data_dir, index_file, phone_index_file)
+
+    def convert_user(self, user_number):
+        if user_number in self.converted:
+            return
+        user_data = self.load_user_file(user_number)
+        if user_data is not None and 'chat_history' in user_data:
+            history = user_data.pop('chat_history')
+            # Archive first, so a crash in between leaves the history in at least one place;
+            # an archive that already exists came from such a crash and is the newer copy
+            if not self.archive.exists(user_number):
+                self.archive.reset(user_number, history)
+            write_json_atomic(self.user_file(user_number), user_data)
+        self.converted.add(user_number)
+
+    def write_user(self, user_number, name, phone_number, history):
+        write_json_atomic(self.user_file(user_number), {'name': name, 'phone_number': phone_number})
+        self.archive.reset(user_number, history)
+        self.converted.add(user_number)
+
+    def delete_user(self, user_number):
+        with self.lock:
+            if not super().delete_user(user_number):
+                return False
+            self.archive.delete(user_number)
+            self.converted.discard(user_number)
+        return True
+
+    def get_history(self, user_number, limit=None, skip_recent=0):
+        with self.lock:
+            self.convert_user(user_number)
+            return self.archive.read(user_number, limit, skip_recent)
+
+    def append_messages(self, user_number, messages):
+        with self.lock:
+            self.convert_user(user_number)
+            self.archive.append(user_number, messages)
+
+    def reset_history(self, user_number, history):
+        with self.lock:
+            self.convert_user(user_number)
+            self.archive.reset(user_number, history)
+
+    # Move a legacy chat_history into the archive and roll the hot log; returns messages rolled
+    def compact(self, user_number):
+        with self.lock:
+            self.convert_user(user_number)
+            return self.archive.roll(user_number)
+
+    def close(self):
+        self.archive.close()
+
+    def data_version(self, user_number=None):
+        version = f"{file_version(self.index_file)}"
+        if user_number is not None:
+            version += f"-{file_version(self.archive.hot_path(user_number))}"
+        return version
+
+    def last_active(self, user_number):
+        hot_path = self.archive.hot_path(user_number)
+        return os.path.getmtime(hot_path) if os.path.exists(hot_path) else super().last_active(user_number)
+
+
+class SqliteStorage(Storage):
+    """SQLite in WAL mode; chat turns are appended as rows instead of rewriting files."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_number INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            phone_number TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_number INTEGER NOT NULL REFERENCES users(user_number) ON DELETE CASCADE,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_number, id);
+        CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone_number);
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(self.SCHEMA)
+
+    def transaction(self):
+        return SqliteTransaction(self)
+
+    def get_user_number(self, telegram_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT user_number FROM users WHERE telegram_id = ?", (str(telegram_id),)
+            ).fetchone()
+        return str(row[0]) if row else None
+
+    def get_user(self, user_number):
+        if not str(user_number).isdigit():
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT name, phone_number FROM users WHERE user_number = ?", (int(user_number),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'name': row[0], 'phone_number': row[1]}
+
+    def list_users(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT telegram_id, user_number FROM users ORDER BY user_number"
+            ).fetchall()
+        return [(uid, str(user_number)) for uid, user_number in rows]
+
+    def profile_filter(self, query):
+        if not query:
+            return "", ()
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return (
+            "WHERE CAST(user_number AS TEXT) = ? OR name LIKE ? ESCAPE '\\' "
+            "OR phone_number LIKE ? ESCAPE '\\' OR telegram_id LIKE ? ESCAPE '\\' ",
+            (query, pattern, pattern, pattern)
+        )
+
+    def list_profiles(self, offset=0, limit=None, query=None):
+        where, params = self.profile_filter(query)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT user_number, telegram_id, name, phone_number FROM users "
+                f"{where}ORDER BY user_number LIMIT ? OFFSET ?",
+                params + (limit if limit else -1, offset)
+            ).fetchall()
+        return [
+            {'user_number': str(user_number), 'telegram_id': uid, 'name': name, 'phone_number': phone_number}
+            for user_number, uid, name, phone_number in rows
+        ]
+
+    def count_users(self, query=None):
+        where, params = self.profile_filter(query)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+
+    def phone_exists(self, phone_number):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM users WHERE phone_number = ?", (phone_number,)
+            ).fetchone()
+        return row is not None
+
+    def create_user(self, telegram_id, name, phone_number, history):
+        with self.transaction() as conn:
+            # BEGIN IMMEDIATE holds the write lock, so check-then-insert cannot race
+            if conn.execute("SELECT 1 FROM users WHERE phone_number = ?", (phone_number,)).fetchone():
+                raise PhoneNumberTaken(phone_number)
+            cursor = conn.execute(
+                "INSERT INTO users (telegram_id, name, phone_number) VALUES (?, ?, ?)",
+                (str(telegram_id), name, phone_number)
+            )
+            user_number = cursor.lastrowid
+            self.insert_messages(conn, user_number, history)
+        return str(user_number)
+
+    def delete_user(self, user_number):
+        if not str(user_number).isdigit():
+            return False
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM users WHERE user_number = ?", (int(user_number),))
+        return cursor.rowcount > 0
+
+    def get_history(self, user_number, limit=None, skip_recent=0):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM ("
+                "  SELECT id, role, content FROM messages WHERE user_number = ?"
+                "  ORDER BY id DESC LIMIT ? OFFSET ?"
+                ") ORDER BY id",
+                (int(user_number), limit if limit else -1, skip_recent)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def export_history(self, user_number):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT role, content, created_at FROM messages WHERE user_number = ? ORDER BY id",
+                (int(user_number),)
+            ).fetchall()
+        return [{"role": role, "content": content, "created_at": created_at} for role, content, created_at in rows]
+
+    # Messages may carry their original created_at (bulk restores); new ones are stamped now
+    def insert_messages(self, conn, user_number, messages):
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO messages (user_number, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(int(user_number), msg['role'], msg['content'], msg.get('created_at') or now) for msg in messages]
+        )
+
+    def append_messages(self, user_number, messages):
+        with self.transaction() as conn:
+            self.insert_messages(conn, user_number, messages)
+
+    def reset_history(self, user_number, history):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE user_number = ?", (int(user_number),))
+            self.insert_messages(conn, user_number, history)
+
+    def import_user(self, telegram_id, user_number, name, phone_number, history):
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM users WHERE user_number = ? OR telegram_id = ?",
+                (int(user_number), str(telegram_id))
+            )
+            conn.execute(
+                "INSERT INTO users (user_number, telegram_id, name, phone_number) VALUES (?, ?, ?, ?)",
+                (int(user_number), str(telegram_id), name, phone_number)
+            )
+            self.insert_messages(conn, user_number, history)
+
+    def rebuild_phone_index(self):
+        with self.transaction() as conn:
+            conn.execute("REINDEX idx_users_phone")
+            rows = conn.execute(
+                "SELECT phone_number, MIN(user_number), GROUP_CONCAT(user_number) FROM users "
+                "GROUP BY phone_number HAVING COUNT(*) > 1"
+            ).fetchall()
+        duplicates = []
+        for phone_number, first, numbers in rows:
+            for user_number in numbers.split(','):
+                if int(user_number) != first:
+                    duplicates.append((phone_number, str(first), user_number))
+        return duplicates
+
+    def data_version(self, user_number=None):
+        # data_version moves on commits from other connections, total_changes on our own
+        with self.lock:
+            other_commits = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            return f"{other_commits}-{self.conn.total_changes}"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SqliteTransaction:
+    """Holds the storage lock for the duration of one BEGIN IMMEDIATE ... COMMIT block."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage.lock.acquire()
+        self.storage.conn.execute("BEGIN IMMEDIATE")
+        return self.storage.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.storage.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.storage.lock.release()
+        return False
+
+
+class LazyStorage:
+    """Stands in for a backend and builds it on first use, so importing the bot does no disk I/O.
+
+    `factory` returns the real storage; attribute lookups are passed through to it.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.backend = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.backend is None:
+            with self.lock:
+                if self.backend is None:
+                    start_time = time.time()
+                    self.backend = self.factory()
+                    logger.info(f"Opened {type(self.backend).__name__} in {time.time() - start_time:.2f} seconds")
+        return self.backend
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+
+BACKENDS = {"json": JsonStorage, "archive": ArchiveStorage, "sqlite": SqliteStorage}
+
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Use 'json', 'archive' or 'sqlite'.")
+    return backend
+
+
+def get_storage(backend=STORAGE_BACKEND):
+    return BACKENDS[check_backend(backend)]()
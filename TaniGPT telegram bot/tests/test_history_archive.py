@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_archive
+from history_archive import HistoryArchive
+
+
+def turns(start, count):
+    return [{"role": "user", "content": f"message {index}"} for index in range(start, start + count)]
+
+
+class HistoryArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tanigpt-archive-")
+        self.archive = HistoryArchive(self.root, hot_messages=4, segment_messages=3)
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def tear_last_line(self, user_number):
+        # What a crash in the middle of an append leaves behind
+        with open(self.archive.hot_path(user_number), 'a', encoding='utf-8') as f:
+            f.write('{"role":"user","content":"cut o')
+
+    def test_roll_keeps_every_message_in_order(self):
+        for start in range(0, 12, 2):
+            self.archive.append("1", turns(start, 2))
+        self.assertTrue(self.archive.segments("1"))
+        self.assertEqual(self.archive.read("1"), turns(0, 12))
+        self.assertEqual(self.archive.read("1", limit=5, skip_recent=2), turns(5, 5))
+
+    def test_reads_skip_a_torn_last_line(self):
+        self.archive.append("1", turns(0, 2))
+        self.tear_last_line("1")
+        self.assertEqual(HistoryArchive(self.root).read("1"), turns(0, 2))
+
+    def test_append_after_a_crash_drops_the_torn_line(self):
+        self.archive.append("1", turns(0, 2))
+        self.tear_last_line("1")
+        restarted = HistoryArchive(self.root)
+        restarted.read("1")
+        restarted.append("1", turns(2, 1))
+        self.assertEqual(HistoryArchive(self.root).read("1"), turns(0, 3))
+        self.assertEqual(restarted.hot_counts["1"], 3)
+
+    @unittest.skipIf(history_archive.fcntl is None, "advisory locks need fcntl")
+    def test_exclusive_lock_waits_for_shared_holders(self):
+        self.assertTrue(self.archive.lock())
+        maintenance = HistoryArchive(self.root)
+        self.assertFalse(maintenance.lock(exclusive=True))
+        self.archive.close()
+        self.assertTrue(maintenance.lock(exclusive=True))
+        self.assertFalse(HistoryArchive(self.root).lock())
+        maintenance.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
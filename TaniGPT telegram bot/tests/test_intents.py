@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import IntentRouter
+
+TABLE = [
+    {"name": "date", "keywords": ["date", "what day"], "handler": "date"},
+    {"name": "greeting", "keywords": ["hello", "hi there"], "response": "Hello!"},
+]
+
+
+class IntentRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tanigpt-intents-")
+        self.path = os.path.join(self.directory, "intents.json")
+        self.write(TABLE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, table):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(table, f)
+
+    def test_table_is_read_on_first_match(self):
+        router = IntentRouter(self.path, reload_interval=60)
+        self.assertFalse(router.loaded)
+        self.assertEqual(router.routes, [])
+        self.assertEqual(router.match("Hello, what day is it?").name, "date")
+        self.assertTrue(router.loaded)
+        self.assertEqual(router.match("hello").answer("hello"), "Hello!")
+        self.assertIsNone(router.match("how do I grow rice"))
+
+    def test_missing_file_disables_routing(self):
+        router = IntentRouter(os.path.join(self.directory, "missing.json"), reload_interval=60)
+        self.assertIsNone(router.match("hello"))
+        self.assertTrue(router.loaded)
+
+    def test_broken_edit_keeps_the_previous_table(self):
+        router = IntentRouter(self.path, reload_interval=0)
+        self.assertIsNotNone(router.match("hello"))
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write("[{")
+        os.utime(self.path, (0, 0))
+        with self.assertLogs("intents", "ERROR"):
+            self.assertIsNotNone(router.match("hello"))
+
+
+if __name__ == "__main__":
+    unittest.main()
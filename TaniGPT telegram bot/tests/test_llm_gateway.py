@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import types
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+from rate_limit import FairScheduler, QueueTimeout
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.raw_response = None
+
+
+def reply(content):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+
+class FakeChat:
+    """Plays back a script of outcomes per model: a reply string, an exception, or a (delay, outcome) pair."""
+
+    def __init__(self, **scripts):
+        self.scripts = {model: list(script) for model, script in scripts.items()}
+        self.calls = []
+
+    async def complete_async(self, model, messages, timeout_ms):
+        self.calls.append(model)
+        outcome = self.scripts[model].pop(0)
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            await asyncio.sleep(delay)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return reply(outcome)
+
+
+def make_gateway(chat, scheduler=None, **kwargs):
+    gateway = LLMGateway("test", scheduler or FairScheduler(4, rate=0), "primary", 5,
+                         fallback_model="fallback", **kwargs)
+    gateway.client = types.SimpleNamespace(chat=chat)
+    gateway.backoff = lambda attempt, deadline: 0
+    for breaker in gateway.breakers.values():
+        breaker.failure_threshold = 2
+        breaker.cooldown = 60
+    return gateway
+
+
+def cool_down(breaker):
+    breaker.opened_at = time.monotonic() - breaker.cooldown - 1
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("m", failures=2, cooldown=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        breaker = CircuitBreaker("m", failures=2, cooldown=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_allows_a_single_trial(self):
+        breaker = CircuitBreaker("m", failures=1, cooldown=60)
+        breaker.record_failure()
+        cool_down(breaker)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_trial_success_closes(self):
+        breaker = CircuitBreaker("m", failures=1, cooldown=60)
+        breaker.record_failure()
+        cool_down(breaker)
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.failures, 0)
+
+    def test_trial_failure_reopens(self):
+        breaker = CircuitBreaker("m", failures=3, cooldown=60)
+        for _ in range(3):
+            breaker.record_failure()
+        cool_down(breaker)
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_released_trial_can_be_retried(self):
+        breaker = CircuitBreaker("m", failures=1, cooldown=60)
+        breaker.record_failure()
+        cool_down(breaker)
+        breaker.allow()
+        breaker.release()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+
+
+class GatewayTest(unittest.IsolatedAsyncioTestCase):
+    async def test_transient_error_is_retried(self):
+        chat = FakeChat(primary=[ProviderError(503), "ok"])
+        gateway = make_gateway(chat)
+        self.assertEqual(await gateway.complete([]), "ok")
+        self.assertEqual(chat.calls, ["primary", "primary"])
+        self.assertEqual(gateway.breakers["primary"].failures, 0)
+
+    async def test_client_error_is_raised_without_counting_against_the_model(self):
+        chat = FakeChat(primary=[ProviderError(400)])
+        gateway = make_gateway(chat)
+        with self.assertRaises(ProviderError):
+            await gateway.complete([])
+        self.assertEqual(chat.calls, ["primary"])
+        self.assertEqual(gateway.breakers["primary"].failures, 0)
+
+    async def test_falls_back_when_the_primary_keeps_failing(self):
+        chat = FakeChat(primary=[ProviderError(503)] * 2, fallback=["from fallback"])
+        gateway = make_gateway(chat, retries=1)
+        fallbacks = metrics.llm_fallbacks.values.get((), 0)
+        self.assertEqual(await gateway.complete([]), "from fallback")
+        self.assertEqual(chat.calls, ["primary", "primary", "fallback"])
+        self.assertEqual(gateway.breakers["primary"].state, "open")
+        self.assertEqual(metrics.llm_fallbacks.values.get((), 0), fallbacks + 1)
+
+    async def test_open_primary_is_skipped(self):
+        chat = FakeChat(fallback=["from fallback"])
+        gateway = make_gateway(chat)
+        gateway.breakers["primary"].opened_at = time.monotonic()
+        self.assertEqual(await gateway.complete([]), "from fallback")
+        self.assertEqual(chat.calls, ["fallback"])
+
+    async def test_all_circuits_open(self):
+        gateway = make_gateway(FakeChat())
+        for breaker in gateway.breakers.values():
+            breaker.opened_at = time.monotonic()
+        with self.assertRaises(LLMUnavailable):
+            await gateway.complete([])
+
+    async def test_half_open_trial_success_closes_the_circuit(self):
+        chat = FakeChat(primary=["ok"])
+        gateway = make_gateway(chat)
+        breaker = gateway.breakers["primary"]
+        cool_down(breaker)
+        self.assertEqual(await gateway.complete([]), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+    async def test_trial_ended_by_client_error_is_released(self):
+        chat = FakeChat(primary=[ProviderError(400), "ok"])
+        gateway = make_gateway(chat)
+        breaker = gateway.breakers["primary"]
+        cool_down(breaker)
+        with self.assertRaises(ProviderError):
+            await gateway.complete([])
+        self.assertFalse(breaker.trial_running)
+        self.assertEqual(await gateway.complete([]), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+    async def test_trial_ended_by_cancellation_is_released(self):
+        chat = FakeChat(primary=[(10, "slow"), "ok"])
+        gateway = make_gateway(chat)
+        breaker = gateway.breakers["primary"]
+        cool_down(breaker)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(gateway.complete([]), 0.05)
+        self.assertFalse(breaker.trial_running)
+        self.assertEqual(await gateway.complete([]), "ok")
+
+    async def test_queue_timeout_is_not_a_provider_failure(self):
+        scheduler = FairScheduler(1, rate=0)
+        chat = FakeChat()
+        gateway = make_gateway(chat, scheduler, deadline=0.05)
+        await scheduler.acquire("someone else")
+        try:
+            with self.assertRaises(QueueTimeout):
+                await gateway.complete([], "user")
+        finally:
+            scheduler.release()
+        self.assertEqual(chat.calls, [])
+        self.assertEqual(gateway.breakers["primary"].failures, 0)
+        self.assertEqual(gateway.breakers["fallback"].failures, 0)
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_hedged_copy_wins_over_a_slow_first_request(self):
+        chat = FakeChat(primary=[(10, "slow"), "fast"])
+        gateway = make_gateway(chat, hedge=True)
+        gateway.latencies.extend([0.01] * 50)
+        hedges = metrics.llm_hedges.values.get((), 0)
+        start = time.monotonic()
+        self.assertEqual(await gateway.complete([]), "fast")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(metrics.llm_hedges.values.get((), 0), hedges + 1)
+        # The losing copy is cancelled and gives its slot back
+        await asyncio.sleep(0.01)
+        self.assertEqual(gateway.scheduler.active, 0)
+
+    async def test_hedged_request_fails_only_when_every_copy_fails(self):
+        chat = FakeChat(primary=[(0.2, ProviderError(503)), (0.1, ProviderError(503))])
+        gateway = make_gateway(chat, hedge=True, retries=0)
+        gateway.latencies.extend([0.01] * 50)
+        with self.assertRaises(ProviderError):
+            await gateway.hedged_request("primary", [], None, time.monotonic() + 5)
+        self.assertEqual(len(chat.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+class MetricsServerTest(unittest.TestCase):
+    def test_port_zero_disables_the_endpoint(self):
+        self.assertIsNone(metrics.start_http_server(0, "127.0.0.1"))
+
+    def test_taken_port_leaves_the_endpoint_off(self):
+        first = metrics.ThreadingHTTPServer(("127.0.0.1", 0), metrics.MetricsHandler)
+        try:
+            port = first.server_address[1]
+            with self.assertLogs(metrics.logger, "ERROR"):
+                self.assertIsNone(metrics.start_http_server(port, "127.0.0.1"))
+        finally:
+            first.server_close()
+
+    def test_serves_metrics(self):
+        server = metrics.ThreadingHTTPServer(("127.0.0.1", 0), metrics.MetricsHandler)
+        port = server.server_address[1]
+        server.server_close()
+        server = metrics.start_http_server(port, "127.0.0.1")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+                self.assertEqual(response.status, 200)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import FairScheduler, QueueTimeout
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_slots_are_handed_out_round_robin_across_users(self):
+        scheduler = FairScheduler(1, rate=0)
+        await scheduler.acquire("holder")
+        served = []
+
+        async def request(user_key):
+            async with scheduler.slot(user_key):
+                served.append(user_key)
+
+        tasks = [asyncio.create_task(request(user_key)) for user_key in ["a", "a", "a", "b", "c"]]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, 5)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        # A user with a backlog doesn't starve the others
+        self.assertEqual(served, ["a", "b", "c", "a", "a"])
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_concurrency_is_bounded(self):
+        scheduler = FairScheduler(2, rate=0)
+        running = peak = 0
+
+        async def request(user_key):
+            nonlocal running, peak
+            async with scheduler.slot(user_key):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(request(f"user {index}") for index in range(6)))
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_timeout_while_queued_leaks_no_slot(self):
+        scheduler = FairScheduler(1, rate=0)
+        await scheduler.acquire("holder")
+        with self.assertRaises(QueueTimeout):
+            async with scheduler.slot("late", timeout=0.02):
+                self.fail("should not get a slot")
+        self.assertEqual(scheduler.active, 1)
+        scheduler.release()
+        self.assertEqual(scheduler.active, 0)
+        self.assertEqual(scheduler.queue_depth, 0)
+        # The abandoned waiter is skipped and the slot is free again
+        await asyncio.wait_for(scheduler.acquire("next"), 0.1)
+        self.assertEqual(scheduler.active, 1)
+
+    async def test_cancelled_right_after_being_granted_gives_the_slot_back(self):
+        scheduler = FairScheduler(1, rate=0)
+        await scheduler.acquire("holder")
+        waiting = asyncio.create_task(scheduler.acquire("user"))
+        await asyncio.sleep(0)
+        # Grant the slot and cancel before the waiter gets to run
+        scheduler.release()
+        self.assertEqual(scheduler.active, 1)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_throttled_pauses_dispatch_with_growing_backoff(self):
+        scheduler = FairScheduler(4, rate=0, backoff=0.05, max_backoff=0.1)
+        scheduler.throttled()
+        start = time.monotonic()
+        async with scheduler.slot("user"):
+            pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+        scheduler.throttled()
+        self.assertEqual(scheduler.backoff, 0.1)
+        scheduler.throttled()
+        self.assertEqual(scheduler.backoff, 0.1)
+        scheduler.recovered()
+        self.assertEqual(scheduler.backoff, 0.0)
+
+    async def test_throttled_honours_retry_after(self):
+        scheduler = FairScheduler(4, rate=0, backoff=0.01)
+        scheduler.throttled(0.1)
+        start = time.monotonic()
+        async with scheduler.slot("user"):
+            pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    async def test_global_rate_paces_dispatch(self):
+        scheduler = FairScheduler(4, rate=50, burst=1)
+        start = time.monotonic()
+        for index in range(4):
+            async with scheduler.slot(f"user {index}"):
+                pass
+        # One request from the burst, then one every 20 ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
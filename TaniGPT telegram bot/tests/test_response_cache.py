@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache, context_fingerprint
+
+SYSTEM = {"role": "system", "content": "You are TaniGPT, a farming assistant."}
+
+
+def conversation(*turns):
+    context = [SYSTEM]
+    for question, answer in turns:
+        context += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    return context
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def make_cache(self, **kwargs):
+        return ResponseCache(enabled=True, max_entries=100, ttl=60, **kwargs)
+
+    def test_prompt_is_normalized(self):
+        cache = self.make_cache()
+        context = conversation()
+        cache.put("How do I water tomatoes?", context, "Deeply, twice a week.")
+        self.assertEqual(cache.get("  how do i WATER tomatoes ", context), "Deeply, twice a week.")
+
+    def test_same_last_reply_after_different_turns_is_not_shared(self):
+        cache = self.make_cache(similarity=0.5)
+        # Both conversations end on the same assistant reply; only an earlier turn differs
+        rice = conversation(("Which crop should I grow?", "Rice."), ("Anything else?", "Tell me more."))
+        wheat = conversation(("Which crop should I grow?", "Wheat."), ("Anything else?", "Tell me more."))
+        self.assertNotEqual(context_fingerprint(rice), context_fingerprint(wheat))
+        cache.put("How much water does it need?", rice, "Rice needs standing water.")
+        self.assertIsNone(cache.get("How much water does it need?", wheat))
+        self.assertIsNone(cache.get("How much water does it need today?", wheat))
+        self.assertEqual(cache.get("How much water does it need?", rice), "Rice needs standing water.")
+
+    def test_similarity_tier_stays_within_one_context(self):
+        cache = self.make_cache(similarity=0.5)
+        first = conversation(("Hi", "Hello!"))
+        second = conversation(("Hello", "Hi there!"))
+        cache.put("best fertilizer for wheat", first, "Urea.")
+        cache.put("best fertilizer for maize", second, "DAP.")
+        self.assertEqual(len(cache.buckets), 2)
+        self.assertEqual(cache.buckets[context_fingerprint(first)], {(context_fingerprint(first), "best fertilizer for wheat")})
+        # A near-duplicate only matches entries made with the same context
+        self.assertEqual(cache.get("best fertilizer for wheat crop", first), "Urea.")
+        self.assertEqual(cache.get("best fertilizer for wheat crop", second), "DAP.")
+        self.assertIsNone(cache.get("best fertilizer for wheat crop", conversation()))
+        self.assertEqual(cache.similar_hits, 2)
+
+    def test_evicted_entries_leave_their_bucket(self):
+        cache = ResponseCache(enabled=True, max_entries=1, ttl=60)
+        first, second = conversation(("a", "b")), conversation(("c", "d"))
+        cache.put("question", first, "one")
+        cache.put("question", second, "two")
+        self.assertIsNone(cache.get("question", first))
+        self.assertEqual(list(cache.buckets), [context_fingerprint(second)])
+
+    def test_expired_entries_are_not_returned(self):
+        cache = ResponseCache(enabled=True, max_entries=10, ttl=-1, similarity=0.5)
+        context = conversation()
+        cache.put("question", context, "answer")
+        self.assertIsNone(cache.get("question", context))
+        self.assertEqual(cache.buckets, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
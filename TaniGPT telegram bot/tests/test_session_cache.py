@@ -0,0 +1,161 @@
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_cache import SessionCache
+from storage import SqliteStorage
+
+
+def turn(text):
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"re: {text}"}]
+
+
+class SessionCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tanigpt-sessions-")
+        self.storage = SqliteStorage(os.path.join(self.directory, "bot.db"))
+        for index in range(1, 4):
+            self.storage.create_user(str(index), f"User {index}", f"+9170000000{index}", [])
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def cache(self, **kwargs):
+        kwargs.setdefault("flush_interval", 60)
+        return SessionCache(self.storage, **kwargs)
+
+    async def test_appends_are_written_behind(self):
+        cache = self.cache()
+        session = await cache.get("1")
+        await cache.append(session, turn("hello"))
+        self.assertTrue(session.dirty)
+        self.assertEqual(self.storage.get_history("1"), [])
+        await cache.flush()
+        self.assertFalse(session.dirty)
+        self.assertEqual(self.storage.get_history("1"), turn("hello"))
+
+    async def test_zero_flush_interval_writes_through(self):
+        cache = self.cache(flush_interval=0)
+        session = await cache.get("1")
+        await cache.append(session, turn("hello"))
+        self.assertFalse(session.dirty)
+        self.assertEqual(self.storage.get_history("1"), turn("hello"))
+
+    async def test_close_flushes_pending_turns(self):
+        cache = self.cache(flush_interval=0.01)
+        cache.start()
+        session = await cache.get("1")
+        await cache.append(session, turn("hello"))
+        await cache.close()
+        self.assertEqual(self.storage.get_history("1"), turn("hello"))
+
+    async def test_history_is_trimmed_but_every_turn_is_stored(self):
+        cache = self.cache(history_limit=2)
+        session = await cache.get("1")
+        await cache.append(session, turn("one"))
+        await cache.append(session, turn("two"))
+        self.assertEqual(session.history, turn("two"))
+        await cache.flush()
+        self.assertEqual(self.storage.get_history("1"), turn("one") + turn("two"))
+
+    async def test_delete_user_drops_pending_turns_and_the_session(self):
+        cache = self.cache()
+        session = await cache.get("1")
+        await cache.append(session, turn("hello"))
+        self.assertTrue(await cache.delete_user("1"))
+        self.assertNotIn("1", cache.sessions)
+        self.assertEqual(session.pending, [])
+        self.assertIsNone(await cache.get("1"))
+        self.assertFalse(await cache.delete_user("1"))
+        # Users without a cached session go straight to storage
+        self.assertTrue(await cache.delete_user("2"))
+        self.assertIsNone(self.storage.get_user("2"))
+
+    async def test_reset_replaces_stored_history_and_discards_pending_turns(self):
+        self.storage.append_messages("1", turn("old"))
+        cache = self.cache()
+        session = await cache.get("1")
+        await cache.append(session, turn("unsaved"))
+        await cache.reset(session, turn("fresh"))
+        self.assertFalse(session.dirty)
+        self.assertEqual(session.history, turn("fresh"))
+        await cache.flush()
+        self.assertEqual(self.storage.get_history("1"), turn("fresh"))
+
+    async def test_failed_flush_on_eviction_keeps_the_session(self):
+        cache = self.cache(max_sessions=1)
+        first = await cache.get("1")
+        await cache.append(first, turn("hello"))
+        append_messages = self.storage.append_messages
+
+        def failing_append(user_number, messages):
+            raise OSError("disk full")
+
+        self.storage.append_messages = failing_append
+        # Another user's request still gets its session
+        second = await cache.get("2")
+        self.assertEqual(second.user_number, "2")
+        self.assertIs(cache.sessions.get("1"), first)
+        self.assertEqual(first.pending, turn("hello"))
+
+        # Once storage recovers the pending turn is written and the session can go
+        self.storage.append_messages = append_messages
+        await cache.flush()
+        self.assertEqual(self.storage.get_history("1"), turn("hello"))
+        await cache.get("3")
+        self.assertNotIn("1", cache.sessions)
+
+    async def test_user_deleted_by_another_process_is_dropped_on_flush(self):
+        cache = self.cache(max_sessions=1)
+        first = await cache.get("1")
+        await cache.append(first, turn("hello"))
+        admin = SqliteStorage(self.storage.path)
+        self.assertTrue(admin.delete_user("1"))
+        admin.close()
+        # Evicting the deleted user's session neither fails this request nor keeps retrying
+        second = await cache.get("2")
+        self.assertEqual(second.user_number, "2")
+        self.assertNotIn("1", cache.sessions)
+        self.assertEqual(first.pending, [])
+        self.assertIsNone(await cache.get("1"))
+
+    async def test_flush_loop_drops_a_deleted_user(self):
+        cache = self.cache()
+        first = await cache.get("1")
+        await cache.append(first, turn("hello"))
+        self.storage.delete_user("1")
+        await cache.flush()
+        self.assertNotIn("1", cache.sessions)
+
+    async def test_busy_sessions_are_not_evicted(self):
+        cache = self.cache(max_sessions=1)
+        debouncing = await cache.get("1")
+        debouncing.inbox.append("hello")
+        generating = await cache.get("2")
+        generating.generation = asyncio.get_running_loop().create_future()
+        await cache.get("3")
+        self.assertIs(cache.sessions.get("1"), debouncing)
+        self.assertIs(cache.sessions.get("2"), generating)
+
+        debouncing.inbox.clear()
+        generating.generation.set_result(None)
+        await cache.get("1")
+        await cache.evict()
+        self.assertEqual(list(cache.sessions), ["1"])
+
+    async def test_session_being_loaded_is_never_evicted(self):
+        cache = self.cache(max_sessions=1)
+        first = await cache.get("1")
+        async with first.lock:
+            second = await cache.get("2")
+        self.assertIs(cache.sessions.get("2"), second)
+
+
+if __name__ == "__main__":
+    unittest.main()
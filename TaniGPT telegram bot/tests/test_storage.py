@@ -0,0 +1,148 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import manage
+from storage import JsonStorage, PhoneNumberTaken, SqliteStorage
+
+
+def turn(text):
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"re: {text}"}]
+
+
+class StorageTests:
+    """Behaviour every backend has to share; subclasses provide open_storage()."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tanigpt-storage-")
+        self.storage = self.open_storage()
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def reopen(self):
+        self.storage.close()
+        self.storage = self.open_storage()
+
+    def test_create_user_rejects_a_taken_phone_number(self):
+        first = self.storage.create_user("100", "Asha", "+917000000001", turn("hello"))
+        with self.assertRaises(PhoneNumberTaken):
+            self.storage.create_user("200", "Ravi", "+917000000001", [])
+        self.assertIsNone(self.storage.get_user_number("200"))
+        self.assertEqual(self.storage.count_users(), 1)
+        self.assertEqual(self.storage.get_history(first), turn("hello"))
+        self.assertTrue(self.storage.phone_exists("+917000000001"))
+
+    def test_deleted_user_frees_the_phone_number_but_not_the_user_number(self):
+        self.storage.create_user("100", "Asha", "+917000000001", [])
+        second = self.storage.create_user("200", "Ravi", "+917000000002", [])
+        self.assertTrue(self.storage.delete_user(second))
+        self.assertFalse(self.storage.delete_user(second))
+        self.assertFalse(self.storage.phone_exists("+917000000002"))
+        third = self.storage.create_user("300", "Meena", "+917000000002", [])
+        self.assertGreater(int(third), int(second))
+        # Not after a restart either
+        self.assertTrue(self.storage.delete_user(third))
+        self.reopen()
+        fourth = self.storage.create_user("400", "Kiran", "+917000000003", [])
+        self.assertGreater(int(fourth), int(third))
+
+    def test_rebuild_phone_index_reports_duplicates(self):
+        self.storage.import_user("100", "1", "Asha", "+917000000001", [])
+        self.storage.import_user("200", "2", "Ravi", "+917000000001", [])
+        self.storage.import_user("300", "3", "Meena", "+917000000003", [])
+        self.assertEqual(self.storage.rebuild_phone_index(), [("+917000000001", "1", "2")])
+        self.assertTrue(self.storage.phone_exists("+917000000003"))
+        self.assertEqual(self.storage.create_user("400", "Kiran", "+917000000004", []), "4")
+
+    def test_profile_query_matches_number_name_phone_and_telegram_id(self):
+        self.storage.create_user("5550100", "Asha Rao", "+917000000001", [])
+        self.storage.create_user("5550200", "Ravi", "+917000000002", [])
+        self.storage.create_user("5550300", "100% Organic", "+917000000003", [])
+
+        def names(query):
+            return [profile['name'] for profile in self.storage.list_profiles(query=query)]
+
+        self.assertEqual(names("asha"), ["Asha Rao"])
+        self.assertEqual(names("2"), ["Ravi"])
+        self.assertEqual(names("+9170000000"), ["Asha Rao", "Ravi", "100% Organic"])
+        self.assertEqual(names("5550300"), ["100% Organic"])
+        # LIKE wildcards in the query are matched literally
+        self.assertEqual(names("%"), ["100% Organic"])
+        self.assertEqual(names("_"), [])
+        self.assertEqual(self.storage.count_users("ravi"), 1)
+        self.assertEqual(self.storage.count_users(), 3)
+        page = self.storage.list_profiles(offset=1, limit=1, query="+9170000000")
+        self.assertEqual([profile['name'] for profile in page], ["Ravi"])
+
+    def test_history_paging(self):
+        user_number = self.storage.create_user("100", "Asha", "+917000000001", turn("one"))
+        self.storage.append_messages(user_number, turn("two") + turn("three"))
+        self.assertEqual(self.storage.get_history(user_number, limit=2), turn("three"))
+        self.assertEqual(self.storage.get_history(user_number, limit=2, skip_recent=2), turn("two"))
+        self.storage.reset_history(user_number, turn("fresh"))
+        self.assertEqual(self.storage.get_history(user_number), turn("fresh"))
+
+
+class JsonStorageTest(StorageTests, unittest.TestCase):
+    def open_storage(self):
+        return JsonStorage(
+            os.path.join(self.directory, "user_data"),
+            os.path.join(self.directory, "user_index.json"),
+            os.path.join(self.directory, "phone_index.json")
+        )
+
+    def test_missing_phone_index_is_rebuilt_from_the_user_files(self):
+        self.storage.create_user("100", "Asha", "+917000000001", [])
+        second = self.storage.create_user("200", "Ravi", "+917000000002", [])
+        self.storage.close()
+        os.remove(os.path.join(self.directory, "phone_index.json"))
+        self.storage = self.open_storage()
+        self.assertTrue(self.storage.phone_exists("+917000000002"))
+        with self.assertRaises(PhoneNumberTaken):
+            self.storage.create_user("300", "Meena", "+917000000002", [])
+        self.assertGreater(int(self.storage.create_user("300", "Meena", "+917000000003", [])), int(second))
+
+
+class SqliteStorageTest(StorageTests, unittest.TestCase):
+    def open_storage(self):
+        return SqliteStorage(os.path.join(self.directory, "bot.db"))
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tanigpt-migrate-")
+        # migrate opens the JSON store with the default phone index path
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_migrate_keeps_user_numbers_and_history(self):
+        source = JsonStorage("user_data", "user_index.json", "phone_index.json")
+        for index in range(1, 4):
+            source.create_user(str(100 * index), f"User {index}", f"+91700000000{index}", turn(f"hi {index}"))
+        source.delete_user("2")
+        manage.migrate(argparse.Namespace(data_dir="user_data", index_file="user_index.json", sqlite_path="bot.db"))
+
+        target = SqliteStorage("bot.db")
+        try:
+            self.assertEqual(target.list_users(), [("100", "1"), ("300", "3")])
+            self.assertEqual(target.get_user("3"), {'name': "User 3", 'phone_number': "+917000000003"})
+            self.assertEqual(target.get_history("3"), turn("hi 3"))
+            self.assertEqual(target.create_user("400", "User 4", "+917000000004", []), "4")
+            with self.assertRaises(PhoneNumberTaken):
+                target.create_user("500", "User 5", "+917000000001", [])
+        finally:
+            target.close()
+
+
+if __name__ == "__main__":
+    unittest.main()